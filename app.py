@@ -15,7 +15,9 @@ st.set_page_config(
 import pandas as pd
 from datetime import datetime, date, timedelta
 import json
+import logging
 import os
+import time
 
 from simple_agent_fixed import SimpleMedicalSchedulingAgent
 from database import DatabaseManager
@@ -24,6 +26,12 @@ from emr_database import EMRDatabase
 from models import Patient, Appointment, AppointmentStatus
 from config import Config
 
+# Agent debug tracing is off unless LOG_LEVEL=DEBUG
+logging.basicConfig(level=Config.LOG_LEVEL)
+
+# Minimum seconds between redraws of a streaming chat reply
+STREAM_REDRAW_INTERVAL = 0.05
+
 # Custom CSS for modern medical UI
 st.markdown("""
 <style>
@@ -510,12 +518,25 @@ def main():
         with st.spinner("🤖 AI is thinking..."):
             try:
                 
-                # Get AI response from the simplified agent
-                ai_response = st.session_state.agent.process_message(prompt)
+                # Stream the AI response from the simplified agent. Chunks are collected in a
+                # list and the full text is redrawn at most every STREAM_REDRAW_INTERVAL, since
+                # each redraw resends everything so far
+                chunks = []
+                with st.chat_message("assistant"):
+                    placeholder = st.empty()
+                    last_redraw = 0.0
+                    for chunk in st.session_state.agent.stream_message(prompt):
+                        chunks.append(chunk)
+                        now = time.monotonic()
+                        if now - last_redraw >= STREAM_REDRAW_INTERVAL:
+                            placeholder.markdown(f'<div class="chat-message ai-message">{"".join(chunks)}</div>', unsafe_allow_html=True)
+                            last_redraw = now
+                    
+                    ai_response = "".join(chunks)
+                    placeholder.markdown(f'<div class="chat-message ai-message">{ai_response}</div>', unsafe_allow_html=True)
                 
                 # Add AI response to chat history
                 st.session_state.messages.append({"content": ai_response, "is_user": False})
-                display_chat_message(ai_response, False)
                 
             except Exception as e:
                 error_message = f"Sorry, I encountered an error: {str(e)}"
@@ -54,9 +54,11 @@ class Config:
     # File Paths
     DATA_DIR = "data"
     PATIENTS_CSV = os.path.join(DATA_DIR, "patients.csv")
-    DOCTORS_SCHEDULE = os.path.join(DATA_DIR, "doctors_schedule.xlsx")
+    DOCTORS_CSV = os.path.join(DATA_DIR, "doctors.csv")
+    DOCTOR_SCHEDULE_CSV = os.path.join(DATA_DIR, "doctor_schedule.csv")
     APPOINTMENTS_JSON = os.path.join(DATA_DIR, "appointments.json")
     REMINDERS_JSON = os.path.join(DATA_DIR, "reminders.json")
+    ID_SEQUENCES_JSON = os.path.join(DATA_DIR, "id_sequences.json")
     
     # Business Rules
     NEW_PATIENT_DURATION = 60  # minutes
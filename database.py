@@ -1,22 +1,60 @@
 """
 Database operations for the Medical Appointment Scheduling AI Agent
 """
-import pandas as pd
 import json
-from typing import List, Optional, Dict, Any
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Dict, Any, Tuple
 from datetime import datetime, date, timedelta
-from models import Patient, Doctor, Appointment, AppointmentStatus, Insurance, Reminder, ReminderType
+from models import Patient, PatientType, Doctor, Appointment, AppointmentStatus, Insurance, Reminder, ReminderType, NON_DIGIT_PATTERN
 from config import Config
 import os
+import tempfile
+import threading
+
+# pandas is imported where it is used so that importing this module (and the
+# agent's tools with it) does not pay for it until a CSV is actually read
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Every DatabaseManager in the process (agent, tools, each Streamlit session)
+# shares the ID counter file, so they must share one lock around it too
+_SEQUENCE_LOCK = threading.Lock()
+
+# Display labels resolved once instead of calling .value.title() per exported row
+PATIENT_TYPE_LABELS = {t: t.value.title() for t in PatientType}
+STATUS_LABELS = {s.value: s.value.title() for s in AppointmentStatus}
+
+# Weekday names as used in the doctor schedule, indexed by date.weekday()
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# One distinct lowercased specialty/location: (value, its characters, doctors having it)
+DoctorIndexEntry = Tuple[str, frozenset, List[Doctor]]
 
 class DatabaseManager:
     """Manages all database operations for the medical scheduling system"""
     
     def __init__(self):
         self.patients_csv = Config.PATIENTS_CSV
-        self.doctors_excel = Config.DOCTORS_SCHEDULE
+        self.doctors_csv = Config.DOCTORS_CSV
+        self.doctor_schedule_csv = Config.DOCTOR_SCHEDULE_CSV
         self.appointments_json = Config.APPOINTMENTS_JSON
         self.reminders_json = Config.REMINDERS_JSON
+        self.id_sequences_json = Config.ID_SEQUENCES_JSON
+        
+        # In-memory patient indexes keyed on (first_name, last_name, date_of_birth)
+        # and on phone digits, rebuilt only when the CSV changes on disk
+        self._patient_by_name_dob: Dict[tuple, Patient] = {}
+        self._patient_by_phone: Dict[str, Patient] = {}
+        self._patients_mtime: Optional[float] = None
+        
+        # Doctors plus indexes on lowercased specialty and location, rebuilt only
+        # when either doctor CSV changes on disk
+        self._doctor_index: Optional[Tuple[List[Doctor], List[DoctorIndexEntry], List[DoctorIndexEntry]]] = None
+        self._doctors_mtime: Optional[tuple] = None
+        
+        # Booked 30-minute slots keyed on (doctor_id, ISO date), rebuilt only when
+        # the appointments file changes on disk
+        self._booked_slots: Dict[tuple, set] = {}
+        self._appointments_mtime: Optional[float] = None
         
         # Ensure data directory exists
         os.makedirs(Config.DATA_DIR, exist_ok=True)
@@ -26,7 +64,11 @@ class DatabaseManager:
         if not os.path.exists(self.patients_csv):
             return []
         
-        df = pd.read_csv(self.patients_csv)
+        import pandas as pd
+        
+        # pyarrow's multithreaded CSV reader; read everything as str so phone
+        # numbers and dates reach the model untouched by type inference
+        df = pd.read_csv(self.patients_csv, engine="pyarrow", dtype=str)
         patients = []
         
         for _, row in df.iterrows():
@@ -35,7 +77,7 @@ class DatabaseManager:
                     id=row['id'],
                     first_name=row['first_name'],
                     last_name=row['last_name'],
-                    date_of_birth=datetime.strptime(row['date_of_birth'], '%Y-%m-%d').date(),
+                    date_of_birth=date.fromisoformat(row['date_of_birth']),
                     phone=str(row['phone']),
                     email=row['email'],
                     address=row['address'],
@@ -51,84 +93,137 @@ class DatabaseManager:
         
         return patients
     
-    def find_patient_by_name_dob(self, first_name: str, last_name: str, date_of_birth: date) -> Optional[Patient]:
-        """Find patient by name and date of birth"""
-        patients = self.load_patients()
+    @staticmethod
+    def _name_dob_key(first_name: str, last_name: str, date_of_birth: date) -> tuple:
+        """Build the lookup key used by the name/DOB patient index"""
+        return (first_name.lower(), last_name.lower(), date_of_birth)
+    
+    def patients_mtime(self) -> Optional[float]:
+        """Modification time of the patient CSV, None if it does not exist yet"""
+        return os.path.getmtime(self.patients_csv) if os.path.exists(self.patients_csv) else None
+    
+    def _get_patient_index(self) -> Dict[tuple, Patient]:
+        """Return the name/DOB patient index, reloading the CSV only if it changed"""
+        mtime = self.patients_mtime()
         
-        for patient in patients:
-            if (patient.first_name.lower() == first_name.lower() and 
-                patient.last_name.lower() == last_name.lower() and 
-                patient.date_of_birth == date_of_birth):
-                return patient
+        if mtime != self._patients_mtime:
+            patients = self.load_patients()
+            self._patient_by_name_dob = {
+                self._name_dob_key(p.first_name, p.last_name, p.date_of_birth): p
+                for p in patients
+            }
+            
+            # First patient with a given number wins, as with a linear scan
+            self._patient_by_phone = {}
+            for p in patients:
+                self._patient_by_phone.setdefault(NON_DIGIT_PATTERN.sub('', p.phone), p)
+            
+            self._patients_mtime = mtime
         
-        return None
+        return self._patient_by_name_dob
+    
+    def find_patient_by_name_dob(self, first_name: str, last_name: str, date_of_birth: date) -> Optional[Patient]:
+        """Find patient by name and date of birth"""
+        return self._get_patient_index().get(self._name_dob_key(first_name, last_name, date_of_birth))
     
     def find_patient_by_phone(self, phone: str) -> Optional[Patient]:
-        """Find patient by phone number"""
-        patients = self.load_patients()
-        
-        # Clean phone number (remove non-digits)
-        clean_phone = ''.join(filter(str.isdigit, phone))
+        """Find patient by phone number, ignoring formatting on either side"""
+        clean_phone = NON_DIGIT_PATTERN.sub('', phone)
+        if not clean_phone:
+            return None
         
-        for patient in patients:
-            if patient.phone == clean_phone:
-                return patient
-        
-        return None
+        self._get_patient_index()
+        return self._patient_by_phone.get(clean_phone)
     
     def add_new_patient(self, patient: Patient) -> bool:
         """Add a new patient to the database"""
         try:
-            # Load existing patients
-            patients = self.load_patients()
+            index = self._get_patient_index()
+            key = self._name_dob_key(patient.first_name, patient.last_name, patient.date_of_birth)
             
             # Check if patient already exists
-            existing = self.find_patient_by_name_dob(
-                patient.first_name, 
-                patient.last_name, 
-                patient.date_of_birth
-            )
-            
-            if existing:
+            if key in index:
                 return False  # Patient already exists
             
-            # Add new patient
-            patients.append(patient)
+            # Append the new row instead of rewriting the whole CSV
+            patient_data = {
+                'id': patient.id,
+                'first_name': patient.first_name,
+                'last_name': patient.last_name,
+                'date_of_birth': patient.date_of_birth.isoformat(),
+                'phone': patient.phone,
+                'email': patient.email,
+                'address': patient.address,
+                'emergency_contact': patient.emergency_contact,
+                'emergency_phone': patient.emergency_phone,
+                'patient_type': patient.patient_type.value,
+                'created_at': patient.created_at.isoformat()
+            }
             
-            # Save to CSV
-            patients_data = []
-            for p in patients:
-                patients_data.append({
-                    'id': p.id,
-                    'first_name': p.first_name,
-                    'last_name': p.last_name,
-                    'date_of_birth': p.date_of_birth.strftime('%Y-%m-%d'),
-                    'phone': p.phone,
-                    'email': p.email,
-                    'address': p.address,
-                    'emergency_contact': p.emergency_contact,
-                    'emergency_phone': p.emergency_phone,
-                    'patient_type': p.patient_type.value,
-                    'created_at': p.created_at.isoformat()
-                })
+            import pandas as pd
+            
+            write_header = not os.path.exists(self.patients_csv)
+            df = pd.DataFrame([patient_data])
+            df.to_csv(self.patients_csv, mode='a', header=write_header, index=False)
             
-            df = pd.DataFrame(patients_data)
-            df.to_csv(self.patients_csv, index=False)
+            # Keep the in-memory index in sync with the file we just wrote
+            index[key] = patient
+            self._patient_by_phone.setdefault(NON_DIGIT_PATTERN.sub('', patient.phone), patient)
+            self._patients_mtime = os.path.getmtime(self.patients_csv)
             return True
             
         except Exception as e:
             print(f"Error adding patient: {e}")
             return False
     
+    def _next_sequence(self, name: str, seed: Callable[[], int]) -> int:
+        """
+        Increment and persist the named ID counter, seeding it from existing data on first use.
+        An unreadable counter file raises rather than reseeding, which could reissue IDs.
+        """
+        with _SEQUENCE_LOCK:
+            sequences = {}
+            if os.path.exists(self.id_sequences_json):
+                with open(self.id_sequences_json, 'r') as f:
+                    sequences = json.load(f)
+            
+            if name not in sequences:
+                sequences[name] = seed()
+            sequences[name] += 1
+            
+            # Write a sibling temp file and swap it in, so an interrupted write
+            # leaves the previous counters intact instead of a truncated file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.id_sequences_json) or ".",
+                                            suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(sequences, f, indent=2)
+                os.replace(tmp_path, self.id_sequences_json)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            
+            return sequences[name]
+    
+    def next_patient_id(self) -> str:
+        """Allocate the next patient ID without loading the patient table"""
+        return f"P{self._next_sequence('patient', lambda: len(self.load_patients())):04d}"
+    
+    def next_appointment_id(self) -> str:
+        """Allocate the next appointment ID without loading the appointments file"""
+        return f"APT{self._next_sequence('appointment', lambda: len(self.load_appointments())):04d}"
+    
     def load_doctors(self) -> List[Doctor]:
-        """Load all doctors from Excel"""
-        if not os.path.exists(self.doctors_excel):
+        """Load all doctors and their weekly schedules from CSV"""
+        if not os.path.exists(self.doctors_csv) or not os.path.exists(self.doctor_schedule_csv):
             return []
         
         try:
+            import pandas as pd
+            
             # Load doctor information
-            df_doctors = pd.read_excel(self.doctors_excel, sheet_name='Doctors')
-            df_schedule = pd.read_excel(self.doctors_excel, sheet_name='Schedule')
+            df_doctors = pd.read_csv(self.doctors_csv)
+            df_schedule = pd.read_csv(self.doctor_schedule_csv)
             
             doctors = []
             
@@ -166,24 +261,120 @@ class DatabaseManager:
             print(f"Error loading doctors: {e}")
             return []
     
+    @staticmethod
+    def _build_doctor_index(doctors: List[Doctor], field: str) -> List[DoctorIndexEntry]:
+        """Group doctors by the lowercased value of field"""
+        groups: Dict[str, List[Doctor]] = {}
+        for doctor in doctors:
+            groups.setdefault(getattr(doctor, field).lower(), []).append(doctor)
+        return [(value, frozenset(value), group) for value, group in groups.items()]
+    
+    def _get_doctor_index(self) -> Tuple[List[Doctor], List[DoctorIndexEntry], List[DoctorIndexEntry]]:
+        """Return (doctors, by_specialty, by_location), reloading the CSVs only if they changed"""
+        mtime = tuple(
+            os.path.getmtime(path) if os.path.exists(path) else None
+            for path in (self.doctors_csv, self.doctor_schedule_csv)
+        )
+        
+        if self._doctor_index is None or mtime != self._doctors_mtime:
+            doctors = self.load_doctors()
+            self._doctor_index = (
+                doctors,
+                self._build_doctor_index(doctors, 'specialty'),
+                self._build_doctor_index(doctors, 'location')
+            )
+            self._doctors_mtime = mtime
+        
+        return self._doctor_index
+    
+    def find_doctors(self, specialty: Optional[str] = None, location: Optional[str] = None) -> List[Doctor]:
+        """
+        Doctors whose specialty and location contain the given values, case-insensitively.
+        Only the distinct indexed values are scanned, not every doctor.
+        """
+        doctors, by_specialty, by_location = self._get_doctor_index()
+        
+        matching_ids = None
+        for index, value in ((by_specialty, specialty), (by_location, location)):
+            if value:
+                needle = value.lower()
+                first = needle[0]
+                # Values missing the needle's first character are rejected by a set
+                # lookup before paying for the substring search
+                ids = {
+                    d.id
+                    for key, chars, group in index
+                    if first in chars and needle in key
+                    for d in group
+                }
+                matching_ids = ids if matching_ids is None else matching_ids & ids
+        
+        if matching_ids is None:
+            return doctors
+        return [d for d in doctors if d.id in matching_ids]
+    
     def get_available_slots(self, doctor_id: str, appointment_date: date, duration: int) -> List[str]:
         """Get available time slots for a doctor on a specific date"""
-        doctors = self.load_doctors()
-        appointments = self.load_appointments()
+        return self.get_available_slots_bulk([doctor_id], appointment_date, duration)[doctor_id]
+    
+    def get_available_slots_bulk(self, doctor_ids: List[str], appointment_date: date,
+                                 duration: int) -> Dict[str, List[str]]:
+        """
+        Get available time slots for several doctors on one date, loading doctors
+        and appointments once for all of them. Unknown doctors map to an empty list.
+        """
+        return dict(self.iter_available_slots(doctor_ids, appointment_date, duration))
+    
+    def iter_available_slots(self, doctor_ids: List[str], appointment_date: date,
+                             duration: int) -> Iterator[Tuple[str, List[str]]]:
+        """
+        Yield (doctor_id, available slots) in doctor_ids order, working out each
+        doctor's slots only when reached so callers can stop early.
+        """
+        wanted = set(doctor_ids)
+        doctors = {d.id: d for d in self._get_doctor_index()[0] if d.id in wanted}
         
-        # Find the doctor
-        doctor = None
-        for d in doctors:
-            if d.id == doctor_id:
-                doctor = d
-                break
+        # Get day name
+        day_name = DAY_NAMES[appointment_date.weekday()]
+        date_str = appointment_date.isoformat()
         
-        if not doctor:
-            return []
+        booked = self._get_booked_slots()
+        no_bookings = frozenset()
         
-        # Get day name
-        day_name = appointment_date.strftime("%A")
+        for doctor_id in doctor_ids:
+            doctor = doctors.get(doctor_id)
+            if doctor is None:
+                yield doctor_id, []
+            else:
+                yield doctor_id, self._free_slots(doctor, day_name,
+                                                  booked.get((doctor_id, date_str), no_bookings), duration)
+    
+    @staticmethod
+    def _index_booked_slots(appointments: List[Dict[str, Any]]) -> Dict[tuple, set]:
+        """Convert appointments to booked 30-minute slots per (doctor_id, ISO date)"""
+        booked: Dict[tuple, set] = {}
+        for apt in appointments:
+            booked_slots = booked.setdefault((apt['doctor_id'], apt['appointment_date']), set())
+            start_hour = int(apt['appointment_time'].split(':')[0])
+            
+            # Mark all slots for this appointment as booked
+            for i in range(apt['duration'] // 30):  # 30-minute slots
+                booked_slots.add(start_hour + i * 0.5)
+        return booked
+    
+    def _get_booked_slots(self) -> Dict[tuple, set]:
+        """Return the booked-slot index, reloading appointments only if the file changed"""
+        mtime = os.path.getmtime(self.appointments_json) if os.path.exists(self.appointments_json) else None
+        
+        if mtime != self._appointments_mtime:
+            self._booked_slots = self._index_booked_slots(self.load_appointments())
+            self._appointments_mtime = mtime
         
+        return self._booked_slots
+    
+    @staticmethod
+    def _free_slots(doctor: Doctor, day_name: str, booked_slots: set, duration: int) -> List[str]:
+        """Start times on day_name where the doctor has duration minutes free"""
         if day_name not in doctor.available_days:
             return []
         
@@ -193,23 +384,6 @@ class DatabaseManager:
         # Filter out lunch break
         available_hours = [h for h in available_hours if not (Config.LUNCH_BREAK_START <= h < Config.LUNCH_BREAK_END)]
         
-        # Get existing appointments for this doctor on this date
-        existing_appointments = [
-            apt for apt in appointments 
-            if apt['doctor_id'] == doctor_id and 
-            datetime.strptime(apt['appointment_date'], '%Y-%m-%d').date() == appointment_date
-        ]
-        
-        # Convert existing appointments to time slots
-        booked_slots = set()
-        for apt in existing_appointments:
-            start_hour = int(apt['appointment_time'].split(':')[0])
-            apt_duration = apt['duration']
-            
-            # Mark all slots for this appointment as booked
-            for i in range(apt_duration // 30):  # 30-minute slots
-                booked_slots.add(start_hour + i * 0.5)
-        
         # Find available slots
         available_slots = []
         for hour in available_hours:
@@ -254,7 +428,7 @@ class DatabaseManager:
                 'id': appointment.id,
                 'patient_id': appointment.patient_id,
                 'doctor_id': appointment.doctor_id,
-                'appointment_date': appointment.appointment_date.strftime('%Y-%m-%d'),
+                'appointment_date': appointment.appointment_date.isoformat(),
                 'appointment_time': appointment.appointment_time,
                 'duration': appointment.duration,
                 'status': appointment.status.value,
@@ -268,6 +442,10 @@ class DatabaseManager:
             with open(self.appointments_json, 'w') as f:
                 json.dump(appointments, f, indent=2)
             
+            # Rebuild the booked-slot index from what we just wrote rather than
+            # reading the file back on the next slot lookup
+            self._booked_slots = self._index_booked_slots(appointments)
+            self._appointments_mtime = os.path.getmtime(self.appointments_json)
             return True
             
         except Exception as e:
@@ -310,10 +488,14 @@ class DatabaseManager:
     
     def save_reminder(self, reminder: Reminder) -> bool:
         """Save a new reminder"""
+        return self.save_reminders([reminder])
+    
+    def save_reminders(self, reminders: List[Reminder]) -> bool:
+        """Save several new reminders with one read and one rewrite of the file"""
         try:
-            reminders = self.load_reminders()
+            stored = self.load_reminders()
             
-            reminder_data = {
+            stored.extend({
                 'id': reminder.id,
                 'appointment_id': reminder.appointment_id,
                 'patient_id': reminder.patient_id,
@@ -322,21 +504,21 @@ class DatabaseManager:
                 'sent': reminder.sent,
                 'response': reminder.response,
                 'created_at': reminder.created_at.isoformat()
-            }
-            
-            reminders.append(reminder_data)
+            } for reminder in reminders)
             
             with open(self.reminders_json, 'w') as f:
-                json.dump(reminders, f, indent=2)
+                json.dump(stored, f, indent=2)
             
             return True
             
         except Exception as e:
-            print(f"Error saving reminder: {e}")
+            print(f"Error saving reminders: {e}")
             return False
     
-    def get_appointments_for_export(self) -> pd.DataFrame:
+    def get_appointments_for_export(self) -> "pd.DataFrame":
         """Get all appointments formatted for Excel export"""
+        import pandas as pd
+        
         appointments = self.load_appointments()
         patients = self.load_patients()
         doctors = self.load_doctors()
@@ -356,14 +538,14 @@ class DatabaseManager:
                     'Patient Name': f"{patient.first_name} {patient.last_name}",
                     'Patient Phone': patient.phone,
                     'Patient Email': patient.email,
-                    'Patient Type': patient.patient_type.value.title(),
+                    'Patient Type': PATIENT_TYPE_LABELS[patient.patient_type],
                     'Doctor Name': doctor.name,
                     'Doctor Specialty': doctor.specialty,
                     'Location': doctor.location,
                     'Appointment Date': apt['appointment_date'],
                     'Appointment Time': apt['appointment_time'],
                     'Duration (minutes)': apt['duration'],
-                    'Status': apt['status'].title(),
+                    'Status': STATUS_LABELS.get(apt['status']) or apt['status'].title(),
                     'Created At': apt['created_at'],
                     'Updated At': apt['updated_at']
                 })
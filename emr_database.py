@@ -5,17 +5,42 @@ Handles patient records, medical history, and appointment tracking
 """
 
 import sqlite3
-import json
+import orjson
 from datetime import datetime, date, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import Any, List, Dict, Optional, Tuple
 from dataclasses import dataclass
 import hashlib
 import random
-from faker import Faker
+import threading
+import time
+from collections import OrderedDict
 
-fake = Faker()
+# Statement text shared by every insert so sqlite3's per-connection
+# prepared-statement cache is hit instead of recompiling the SQL
+INSERT_PATIENT_SQL = '''
+    INSERT INTO patients (
+        patient_id, first_name, last_name, date_of_birth, phone, email,
+        address, emergency_contact, emergency_phone, insurance_provider,
+        insurance_id, medical_history, allergies, current_medications,
+        last_visit, total_visits, patient_type, created_at, updated_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
 
-@dataclass
+INSERT_APPOINTMENT_SQL = '''
+    INSERT INTO appointments (
+        appointment_id, patient_id, doctor_id, appointment_date,
+        appointment_time, duration, status, reason, notes, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Phone, then email, then full-name match, in a single multi-index OR lookup
+PATIENT_LOOKUP_WHERE = '''
+    WHERE phone = ? OR email = ? OR (first_name = ? AND last_name = ?)
+    ORDER BY CASE WHEN phone = ? THEN 0 WHEN email = ? THEN 1 ELSE 2 END
+    LIMIT 1
+'''
+
+@dataclass(slots=True)
 class PatientRecord:
     """Patient medical record"""
     patient_id: str
@@ -38,7 +63,7 @@ class PatientRecord:
     created_at: datetime
     updated_at: datetime
 
-@dataclass
+@dataclass(slots=True)
 class AppointmentRecord:
     """Appointment record in EMR"""
     appointment_id: str
@@ -52,16 +77,82 @@ class AppointmentRecord:
     notes: str
     created_at: datetime
 
+class TTLCache:
+    """Thread-safe LRU cache with a time-to-live; caching a None value records a miss"""
+    
+    def __init__(self, maxsize: int = 2048, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: tuple) -> Tuple[bool, Any]:
+        """Return (hit, value); a cached miss is a hit with value None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            
+            # Recency only decides what gets evicted, so skip tracking it
+            # until the cache is actually full
+            if len(self._entries) >= self.maxsize:
+                self._entries.move_to_end(key)
+            return True, value
+    
+    def put(self, key: tuple, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 class EMRDatabase:
     """EMR Database Manager"""
     
+    # Patient lookup caches shared by every instance pointing at the same file,
+    # so a write through one instance invalidates reads through the others.
+    # That makes the TTL only a bound on staleness from outside writers, so it
+    # can span a whole conversation's worth of repeated detect_patient_type calls.
+    _row_caches: Dict[str, TTLCache] = {}
+    _ROW_CACHE_TTL = 300.0
+    
     def __init__(self, db_path: str = "data/emr_database.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        self._fts_enabled = False
+        self._row_cache = EMRDatabase._row_caches.setdefault(db_path, TTLCache(ttl=self._ROW_CACHE_TTL))
         self.init_database()
     
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's cached connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            
+            # WAL lets readers and the writer proceed concurrently and persists in the
+            # database file (not applicable in-memory); the rest are per-connection
+            if self.db_path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-20000")
+            
+            self._local.conn = conn
+        return conn
+    
     def init_database(self):
         """Initialize the EMR database with tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn()
         cursor = conn.cursor()
         
         # Patients table
@@ -78,9 +169,9 @@ class EMRDatabase:
                 emergency_phone TEXT NOT NULL,
                 insurance_provider TEXT,
                 insurance_id TEXT,
-                medical_history TEXT,  -- JSON array
-                allergies TEXT,        -- JSON array
-                current_medications TEXT,  -- JSON array
+                medical_history TEXT,  -- compact JSON array, NULL when empty
+                allergies TEXT,        -- compact JSON array, NULL when empty
+                current_medications TEXT,  -- compact JSON array, NULL when empty
                 last_visit DATE,
                 total_visits INTEGER DEFAULT 0,
                 patient_type TEXT DEFAULT 'new',
@@ -129,58 +220,122 @@ class EMRDatabase:
         # Create indexes for better performance
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_phone ON patients(phone)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_email ON patients(email)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(last_name, first_name)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_patient ON appointments(patient_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments(patient_id, appointment_date DESC, appointment_time DESC)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments(appointment_date)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_visits_patient ON medical_visits(patient_id)')
         
         conn.commit()
-        conn.close()
+        
+        self._fts_enabled = self._init_search_index(conn)
+    
+    def _init_search_index(self, conn: sqlite3.Connection) -> bool:
+        """
+        Create the FTS5 search index over patient name/phone/email.
+        Returns False if this SQLite build lacks FTS5 or the trigram tokenizer,
+        in which case search_patients falls back to LIKE scans.
+        """
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+            ).fetchone()
+            
+            with conn:
+                # Trigram tokens keep the substring semantics of the old LIKE '%q%' search
+                conn.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                        first_name, last_name, phone, email,
+                        content='patients', content_rowid='rowid', tokenize='trigram'
+                    )
+                ''')
+                
+                # Keep the external-content index in sync with the patients table
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+                        INSERT INTO patients_fts(rowid, first_name, last_name, phone, email)
+                        VALUES (new.rowid, new.first_name, new.last_name, new.phone, new.email);
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+                        INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, phone, email)
+                        VALUES ('delete', old.rowid, old.first_name, old.last_name, old.phone, old.email);
+                    END
+                ''')
+                conn.execute('''
+                    CREATE TRIGGER IF NOT EXISTS patients_fts_au
+                    AFTER UPDATE OF first_name, last_name, phone, email ON patients BEGIN
+                        INSERT INTO patients_fts(patients_fts, rowid, first_name, last_name, phone, email)
+                        VALUES ('delete', old.rowid, old.first_name, old.last_name, old.phone, old.email);
+                        INSERT INTO patients_fts(rowid, first_name, last_name, phone, email)
+                        VALUES (new.rowid, new.first_name, new.last_name, new.phone, new.email);
+                    END
+                ''')
+                
+                # Index rows written before the FTS table existed
+                if not exists:
+                    conn.execute("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')")
+            
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable, using LIKE search: {e}")
+            return False
+    
+    @staticmethod
+    def _encode_list(values: List[str]) -> Optional[str]:
+        """Encode a list column as compact JSON text; empty lists are stored as NULL"""
+        return orjson.dumps(values).decode() if values else None
+    
+    def _insert_patients(self, cursor: sqlite3.Cursor, patients: List[PatientRecord]):
+        """Insert patient rows in one executemany call using an existing cursor (no commit)"""
+        cursor.executemany(INSERT_PATIENT_SQL, [(
+            patient.patient_id, patient.first_name, patient.last_name,
+            patient.date_of_birth, patient.phone, patient.email,
+            patient.address, patient.emergency_contact, patient.emergency_phone,
+            patient.insurance_provider, patient.insurance_id,
+            self._encode_list(patient.medical_history),
+            self._encode_list(patient.allergies),
+            self._encode_list(patient.current_medications),
+            patient.last_visit, patient.total_visits, patient.patient_type,
+            patient.created_at, patient.updated_at
+        ) for patient in patients])
     
     def add_patient(self, patient: PatientRecord) -> bool:
         """Add a new patient to the EMR database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO patients (
-                    patient_id, first_name, last_name, date_of_birth, phone, email,
-                    address, emergency_contact, emergency_phone, insurance_provider,
-                    insurance_id, medical_history, allergies, current_medications,
-                    last_visit, total_visits, patient_type, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                patient.patient_id, patient.first_name, patient.last_name,
-                patient.date_of_birth, patient.phone, patient.email,
-                patient.address, patient.emergency_contact, patient.emergency_phone,
-                patient.insurance_provider, patient.insurance_id,
-                json.dumps(patient.medical_history),
-                json.dumps(patient.allergies),
-                json.dumps(patient.current_medications),
-                patient.last_visit, patient.total_visits, patient.patient_type,
-                patient.created_at, patient.updated_at
-            ))
+            conn = self._conn()
+            with conn:
+                self._insert_patients(conn.cursor(), [patient])
             
-            conn.commit()
-            conn.close()
+            self._row_cache.clear()
             return True
         except Exception as e:
             print(f"Error adding patient: {e}")
             return False
     
+    def _cached_row(self, cache_key: tuple, sql: str, params: tuple) -> Optional[tuple]:
+        """Fetch a single row through the row cache"""
+        hit, row = self._row_cache.get(cache_key)
+        if not hit:
+            row = self._conn().execute(sql, params).fetchone()
+            self._row_cache.put(cache_key, row)
+        return row
+    
+    def _fetch_patient(self, cache_key: tuple, sql: str, params: tuple) -> Optional[PatientRecord]:
+        """Run a single-patient lookup through the row cache"""
+        row = self._cached_row(cache_key, sql, params)
+        
+        # Build a fresh record per call so callers can't mutate cached state
+        if row:
+            return self._row_to_patient_record(row)
+        return None
+    
     def get_patient_by_phone(self, phone: str) -> Optional[PatientRecord]:
         """Get patient by phone number"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM patients WHERE phone = ?', (phone,))
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                return self._row_to_patient_record(row)
-            return None
+            return self._fetch_patient(('phone', phone),
+                                       'SELECT * FROM patients WHERE phone = ?', (phone,))
         except Exception as e:
             print(f"Error getting patient by phone: {e}")
             return None
@@ -188,16 +343,8 @@ class EMRDatabase:
     def get_patient_by_email(self, email: str) -> Optional[PatientRecord]:
         """Get patient by email"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM patients WHERE email = ?', (email,))
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                return self._row_to_patient_record(row)
-            return None
+            return self._fetch_patient(('email', email),
+                                       'SELECT * FROM patients WHERE email = ?', (email,))
         except Exception as e:
             print(f"Error getting patient by email: {e}")
             return None
@@ -205,62 +352,101 @@ class EMRDatabase:
     def get_patient_by_name(self, first_name: str, last_name: str) -> Optional[PatientRecord]:
         """Get patient by name"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM patients WHERE first_name = ? AND last_name = ?', 
-                         (first_name, last_name))
-            row = cursor.fetchone()
-            conn.close()
-            
-            if row:
-                return self._row_to_patient_record(row)
-            return None
+            return self._fetch_patient(('name', first_name, last_name),
+                                       'SELECT * FROM patients WHERE first_name = ? AND last_name = ?',
+                                       (first_name, last_name))
         except Exception as e:
             print(f"Error getting patient by name: {e}")
             return None
     
+    @staticmethod
+    def _lookup_params(phone: str = None, email: str = None,
+                       first_name: str = None, last_name: str = None) -> Optional[tuple]:
+        """
+        Normalize lookup identifiers for PATIENT_LOOKUP_WHERE.
+        Blank identifiers bind as NULL, which never compares equal.
+        Returns None when there is nothing to look up by.
+        """
+        phone = phone or None
+        email = email or None
+        if not (first_name and last_name):
+            first_name = last_name = None
+        
+        if not (phone or email or first_name):
+            return None
+        return (phone, email, first_name, last_name, phone, email)
+    
+    def find_patient(self, phone: str = None, email: str = None,
+                     first_name: str = None, last_name: str = None) -> Optional[PatientRecord]:
+        """
+        Find a patient by phone, email, or full name in a single query.
+        Matches are preferred in that order, as with the individual getters.
+        """
+        params = self._lookup_params(phone, email, first_name, last_name)
+        if params is None:
+            return None
+        
+        try:
+            return self._fetch_patient(('find',) + params[:4],
+                                       f'SELECT * FROM patients {PATIENT_LOOKUP_WHERE}', params)
+        except Exception as e:
+            print(f"Error finding patient: {e}")
+            return None
+    
+    def is_returning_patient(self, phone: str = None, email: str = None,
+                             first_name: str = None, last_name: str = None) -> bool:
+        """
+        Lightweight new-vs-returning probe for callers that don't need the record.
+        Selects only total_visits, skipping the full row decode and JSON parsing.
+        """
+        params = self._lookup_params(phone, email, first_name, last_name)
+        if params is None:
+            return False
+        
+        try:
+            row = self._cached_row(('returning',) + params[:4],
+                                   f'SELECT total_visits FROM patients {PATIENT_LOOKUP_WHERE}', params)
+            return bool(row and row[0] > 0)
+        except Exception as e:
+            print(f"Error checking returning patient: {e}")
+            return False
+    
     def update_patient_visit(self, patient_id: str, visit_date: date) -> bool:
         """Update patient's visit information"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            conn = self._conn()
             
             # Update last visit and increment total visits
-            cursor.execute('''
-                UPDATE patients 
-                SET last_visit = ?, total_visits = total_visits + 1, 
-                    patient_type = 'returning', updated_at = CURRENT_TIMESTAMP
-                WHERE patient_id = ?
-            ''', (visit_date, patient_id))
+            with conn:
+                conn.execute('''
+                    UPDATE patients 
+                    SET last_visit = ?, total_visits = total_visits + 1, 
+                        patient_type = 'returning', updated_at = CURRENT_TIMESTAMP
+                    WHERE patient_id = ?
+                ''', (visit_date, patient_id))
             
-            conn.commit()
-            conn.close()
+            self._row_cache.clear()
             return True
         except Exception as e:
             print(f"Error updating patient visit: {e}")
             return False
     
+    def _insert_appointments(self, cursor: sqlite3.Cursor, appointments: List[AppointmentRecord]):
+        """Insert appointment rows in one executemany call using an existing cursor (no commit)"""
+        cursor.executemany(INSERT_APPOINTMENT_SQL, [(
+            appointment.appointment_id, appointment.patient_id, appointment.doctor_id,
+            appointment.appointment_date, appointment.appointment_time,
+            appointment.duration, appointment.status, appointment.reason,
+            appointment.notes, appointment.created_at
+        ) for appointment in appointments])
+    
     def add_appointment(self, appointment: AppointmentRecord) -> bool:
         """Add appointment to EMR database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO appointments (
-                    appointment_id, patient_id, doctor_id, appointment_date,
-                    appointment_time, duration, status, reason, notes, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                appointment.appointment_id, appointment.patient_id, appointment.doctor_id,
-                appointment.appointment_date, appointment.appointment_time,
-                appointment.duration, appointment.status, appointment.reason,
-                appointment.notes, appointment.created_at
-            ))
+            conn = self._conn()
+            with conn:
+                self._insert_appointments(conn.cursor(), [appointment])
             
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Error adding appointment: {e}")
@@ -269,8 +455,7 @@ class EMRDatabase:
     def get_patient_appointments(self, patient_id: str) -> List[AppointmentRecord]:
         """Get all appointments for a patient"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
             cursor.execute('''
                 SELECT * FROM appointments 
@@ -279,7 +464,6 @@ class EMRDatabase:
             ''', (patient_id,))
             
             rows = cursor.fetchall()
-            conn.close()
             
             return [self._row_to_appointment_record(row) for row in rows]
         except Exception as e:
@@ -292,19 +476,8 @@ class EMRDatabase:
         Detect if patient is new or returning based on EMR database
         Returns: (PatientRecord or None, 'new' or 'returning')
         """
-        patient = None
-        
-        # Try to find patient by phone first
-        if phone:
-            patient = self.get_patient_by_phone(phone)
-        
-        # Try email if not found by phone
-        if not patient and email:
-            patient = self.get_patient_by_email(email)
-        
-        # Try name if not found by phone or email
-        if not patient and first_name and last_name:
-            patient = self.get_patient_by_name(first_name, last_name)
+        patient = self.find_patient(phone=phone, email=email,
+                                    first_name=first_name, last_name=last_name)
         
         if patient:
             # Patient exists in EMR - check if they have previous visits
@@ -332,7 +505,7 @@ class EMRDatabase:
             patient_id=row[0],
             first_name=row[1],
             last_name=row[2],
-            date_of_birth=datetime.strptime(row[3], '%Y-%m-%d').date(),
+            date_of_birth=date.fromisoformat(row[3]),
             phone=row[4],
             email=row[5],
             address=row[6],
@@ -340,10 +513,10 @@ class EMRDatabase:
             emergency_phone=row[8],
             insurance_provider=row[9],
             insurance_id=row[10],
-            medical_history=json.loads(row[11]) if row[11] else [],
-            allergies=json.loads(row[12]) if row[12] else [],
-            current_medications=json.loads(row[13]) if row[13] else [],
-            last_visit=datetime.strptime(row[14], '%Y-%m-%d').date() if row[14] else None,
+            medical_history=orjson.loads(row[11]) if row[11] else [],
+            allergies=orjson.loads(row[12]) if row[12] else [],
+            current_medications=orjson.loads(row[13]) if row[13] else [],
+            last_visit=date.fromisoformat(row[14]) if row[14] else None,
             total_visits=row[15],
             patient_type=row[16],
             created_at=datetime.fromisoformat(row[17]),
@@ -356,7 +529,7 @@ class EMRDatabase:
             appointment_id=row[0],
             patient_id=row[1],
             doctor_id=row[2],
-            appointment_date=datetime.strptime(row[3], '%Y-%m-%d').date(),
+            appointment_date=date.fromisoformat(row[3]),
             appointment_time=row[4],
             duration=row[5],
             status=row[6],
@@ -368,33 +541,51 @@ class EMRDatabase:
     def get_all_patients(self) -> List[PatientRecord]:
         """Get all patients from EMR database"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
             cursor.execute('SELECT * FROM patients ORDER BY created_at DESC')
             rows = cursor.fetchall()
-            conn.close()
             
             return [self._row_to_patient_record(row) for row in rows]
         except Exception as e:
             print(f"Error getting all patients: {e}")
             return []
     
+    def count_by_type(self) -> Dict[str, int]:
+        """Count patients per patient_type without loading any records"""
+        try:
+            cursor = self._conn().cursor()
+            
+            cursor.execute('SELECT patient_type, COUNT(*) FROM patients GROUP BY patient_type')
+            
+            return dict(cursor.fetchall())
+        except Exception as e:
+            print(f"Error counting patients by type: {e}")
+            return {}
+    
     def search_patients(self, query: str) -> List[PatientRecord]:
         """Search patients by name, phone, or email"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
-            search_term = f"%{query}%"
-            cursor.execute('''
-                SELECT * FROM patients 
-                WHERE first_name LIKE ? OR last_name LIKE ? OR phone LIKE ? OR email LIKE ?
-                ORDER BY last_name, first_name
-            ''', (search_term, search_term, search_term, search_term))
+            # Trigram matching needs at least three characters
+            if self._fts_enabled and len(query) >= 3:
+                match_term = '"' + query.replace('"', '""') + '"'
+                cursor.execute('''
+                    SELECT p.* FROM patients p
+                    JOIN patients_fts f ON f.rowid = p.rowid
+                    WHERE patients_fts MATCH ?
+                    ORDER BY p.last_name, p.first_name
+                ''', (match_term,))
+            else:
+                search_term = f"%{query}%"
+                cursor.execute('''
+                    SELECT * FROM patients 
+                    WHERE first_name LIKE ? OR last_name LIKE ? OR phone LIKE ? OR email LIKE ?
+                    ORDER BY last_name, first_name
+                ''', (search_term, search_term, search_term, search_term))
             
             rows = cursor.fetchall()
-            conn.close()
             
             return [self._row_to_patient_record(row) for row in rows]
         except Exception as e:
@@ -405,6 +596,8 @@ class EMRDataGenerator:
     """Generate synthetic EMR data"""
     
     def __init__(self):
+        # Imported here so serving code that only needs EMRDatabase never loads Faker
+        from faker import Faker
         self.fake = Faker()
         self.medical_conditions = [
             "Hypertension", "Diabetes Type 2", "High Cholesterol", "Asthma",
@@ -431,72 +624,77 @@ class EMRDataGenerator:
             "Kaiser Permanente", "Humana", "Anthem", "Medicare",
             "Medicaid", "Tricare", "AARP", "Oscar Health"
         ]
+        
+        self.appointment_reasons = [
+            "Annual checkup", "Follow-up visit", "New symptoms", "Prescription refill",
+            "Lab results review", "Specialist consultation", "Vaccination",
+            "Chronic condition management", "Preventive care", "Emergency visit"
+        ]
+        
+        self.appointment_times = ['09:00', '10:00', '11:00', '14:00', '15:00', '16:00']
+        self.doctor_ids = ['D001', 'D002', 'D003', 'D004', 'D005']
     
     def generate_patient_record(self, patient_id: str) -> PatientRecord:
         """Generate a synthetic patient record"""
-        first_name = self.fake.first_name()
-        last_name = self.fake.last_name()
-        birth_date = self.fake.date_of_birth(minimum_age=18, maximum_age=80)
-        
-        # Generate medical history (2-5 conditions)
-        num_conditions = random.randint(2, 5)
-        medical_history = random.sample(self.medical_conditions, num_conditions)
-        
-        # Generate allergies (0-3 allergies)
-        num_allergies = random.randint(0, 3)
-        allergies = random.sample(self.allergies, num_allergies) if num_allergies > 0 else []
+        return self.generate_patient_records([patient_id])[0]
+    
+    def generate_patient_records(self, patient_ids: List[str]) -> List[PatientRecord]:
+        """Generate synthetic patient records, drawing per-patient counts in batches"""
+        count = len(patient_ids)
         
-        # Generate current medications (1-4 medications)
-        num_meds = random.randint(1, 4)
-        current_medications = random.sample(self.medications, num_meds)
+        # Medical history (2-5 conditions), allergies (0-3), current medications (1-4)
+        condition_counts = random.choices(range(2, 6), k=count)
+        allergy_counts = random.choices(range(0, 4), k=count)
+        medication_counts = random.choices(range(1, 5), k=count)
         
         # Determine if patient is new or returning (70% returning, 30% new)
-        is_returning = random.random() < 0.7
-        total_visits = random.randint(1, 15) if is_returning else 0
-        last_visit = self.fake.date_between(start_date='-2y', end_date='-1d') if is_returning else None
+        returning_flags = [random.random() < 0.7 for _ in range(count)]
+        insurance_providers = random.choices(self.insurance_providers, k=count)
+        now = datetime.now()
         
-        return PatientRecord(
-            patient_id=patient_id,
-            first_name=first_name,
-            last_name=last_name,
-            date_of_birth=birth_date,
-            phone=self.fake.phone_number()[:10],  # Ensure 10 digits
-            email=self.fake.email(),
-            address=self.fake.address(),
-            emergency_contact=f"{self.fake.first_name()} {self.fake.last_name()}",
-            emergency_phone=self.fake.phone_number()[:10],
-            insurance_provider=random.choice(self.insurance_providers),
-            insurance_id=self.fake.bothify(text='#########'),
-            medical_history=medical_history,
-            allergies=allergies,
-            current_medications=current_medications,
-            last_visit=last_visit,
-            total_visits=total_visits,
-            patient_type='returning' if is_returning else 'new',
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
+        records = []
+        for patient_id, num_conditions, num_allergies, num_meds, is_returning, insurance_provider in zip(
+            patient_ids, condition_counts, allergy_counts, medication_counts,
+            returning_flags, insurance_providers
+        ):
+            records.append(PatientRecord(
+                patient_id=patient_id,
+                first_name=self.fake.first_name(),
+                last_name=self.fake.last_name(),
+                date_of_birth=self.fake.date_of_birth(minimum_age=18, maximum_age=80),
+                phone=self.fake.phone_number()[:10],  # Ensure 10 digits
+                email=self.fake.email(),
+                address=self.fake.address(),
+                emergency_contact=f"{self.fake.first_name()} {self.fake.last_name()}",
+                emergency_phone=self.fake.phone_number()[:10],
+                insurance_provider=insurance_provider,
+                insurance_id=self.fake.bothify(text='#########'),
+                medical_history=random.sample(self.medical_conditions, num_conditions),
+                allergies=random.sample(self.allergies, num_allergies) if num_allergies > 0 else [],
+                current_medications=random.sample(self.medications, num_meds),
+                last_visit=self.fake.date_between(start_date='-2y', end_date='-1d') if is_returning else None,
+                total_visits=random.randint(1, 15) if is_returning else 0,
+                patient_type='returning' if is_returning else 'new',
+                created_at=now,
+                updated_at=now
+            ))
+        
+        return records
     
     def generate_appointment_record(self, patient_id: str, appointment_id: str) -> AppointmentRecord:
         """Generate a synthetic appointment record"""
         appointment_date = self.fake.date_between(start_date='-6m', end_date='+1m')
-        appointment_time = random.choice(['09:00', '10:00', '11:00', '14:00', '15:00', '16:00'])
-        
-        reasons = [
-            "Annual checkup", "Follow-up visit", "New symptoms", "Prescription refill",
-            "Lab results review", "Specialist consultation", "Vaccination",
-            "Chronic condition management", "Preventive care", "Emergency visit"
-        ]
+        appointment_time = random.choice(self.appointment_times)
         
         return AppointmentRecord(
             appointment_id=appointment_id,
             patient_id=patient_id,
-            doctor_id=random.choice(['D001', 'D002', 'D003', 'D004', 'D005']),
+            doctor_id=random.choice(self.doctor_ids),
             appointment_date=appointment_date,
             appointment_time=appointment_time,
             duration=random.choice([30, 60]),  # Will be updated based on patient type
             status=random.choice(['completed', 'scheduled', 'cancelled']),
-            reason=random.choice(reasons),
+            reason=random.choice(self.appointment_reasons),
             notes=self.fake.text(max_nb_chars=200),
             created_at=datetime.now()
         )
@@ -508,24 +706,34 @@ class EMRDataGenerator:
             
             print(f"Generating {num_patients} synthetic patients...")
             
-            for i in range(num_patients):
-                patient_id = f"EMR_{i+1:03d}"
-                patient = self.generate_patient_record(patient_id)
-                
-                # Add patient to database
-                emr_db.add_patient(patient)
+            # Six digits keep IDs sorting correctly well past 999 patients
+            patient_ids = [f"EMR_{i:06d}" for i in range(1, num_patients + 1)]
+            patients = self.generate_patient_records(patient_ids)
+            appointments = []
+            
+            for patient in patients:
+                patient_id = patient.patient_id
                 
                 # Generate 1-3 appointments for returning patients
                 if patient.patient_type == 'returning':
                     num_appointments = random.randint(1, 3)
-                    for j in range(num_appointments):
-                        appointment_id = f"APT_{patient_id}_{j+1}"
+                    for j in range(1, num_appointments + 1):
+                        appointment_id = f"APT_{patient_id}_{j}"
                         appointment = self.generate_appointment_record(patient_id, appointment_id)
                         
                         # Update duration based on patient type
                         appointment.duration = emr_db.get_smart_duration(patient, patient.patient_type)
                         
-                        emr_db.add_appointment(appointment)
+                        appointments.append(appointment)
+            
+            # One connection, one transaction and one executemany per table
+            conn = emr_db._conn()
+            with conn:
+                cursor = conn.cursor()
+                emr_db._insert_patients(cursor, patients)
+                emr_db._insert_appointments(cursor, appointments)
+            
+            emr_db._row_cache.clear()
             
             print(f"✅ Successfully populated EMR database with {num_patients} patients")
             return True
@@ -558,11 +766,9 @@ if __name__ == "__main__":
         print(f"No patient found with phone: {test_phone}")
     
     # Show database statistics
-    all_patients = emr_db.get_all_patients()
-    new_patients = [p for p in all_patients if p.patient_type == 'new']
-    returning_patients = [p for p in all_patients if p.patient_type == 'returning']
+    type_counts = emr_db.count_by_type()
     
     print(f"\n📊 Database Statistics:")
-    print(f"Total patients: {len(all_patients)}")
-    print(f"New patients: {len(new_patients)}")
-    print(f"Returning patients: {len(returning_patients)}")
+    print(f"Total patients: {sum(type_counts.values())}")
+    print(f"New patients: {type_counts.get('new', 0)}")
+    print(f"Returning patients: {type_counts.get('returning', 0)}")
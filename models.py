@@ -1,12 +1,17 @@
 """
 Data models for the Medical Appointment Scheduling AI Agent
 """
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, field_validator
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
 from enum import Enum
 import re
 
+# Validation patterns compiled once at import time
+NON_DIGIT_PATTERN = re.compile(r'\D')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+TIME_PATTERN = re.compile(r'^([01]?[0-9]|2[0-3]):[0-5][0-9]$')
+
 class PatientType(str, Enum):
     NEW = "new"
     RETURNING = "returning"
@@ -37,18 +42,19 @@ class Patient(BaseModel):
     patient_type: PatientType
     created_at: datetime = Field(default_factory=datetime.now)
     
-    @validator('phone')
+    @field_validator('phone')
+    @classmethod
     def validate_phone(cls, v):
         # Remove all non-digit characters
-        phone_digits = re.sub(r'\D', '', v)
+        phone_digits = NON_DIGIT_PATTERN.sub('', v)
         if len(phone_digits) < 10:
             raise ValueError('Phone number must be at least 10 digits')
         return v  # Return original format for international numbers
     
-    @validator('email')
+    @field_validator('email')
+    @classmethod
     def validate_email(cls, v):
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if not re.match(email_pattern, v):
+        if not EMAIL_PATTERN.match(v):
             raise ValueError('Invalid email format')
         return v.lower()
 
@@ -83,10 +89,10 @@ class Appointment(BaseModel):
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     
-    @validator('appointment_time')
+    @field_validator('appointment_time')
+    @classmethod
     def validate_time_format(cls, v):
-        time_pattern = r'^([01]?[0-9]|2[0-3]):[0-5][0-9]$'
-        if not re.match(time_pattern, v):
+        if not TIME_PATTERN.match(v):
             raise ValueError('Time must be in HH:MM format')
         return v
 
@@ -1,15 +1,94 @@
 """
 Perplexity AI Integration for Medical Appointment Scheduling AI Agent
 """
+import asyncio
 import httpx
-import json
-from typing import List, Dict, Any, Optional
+import orjson
+import random
+import threading
+import time
+import weakref
+from typing import List, Dict, Any, Optional, AsyncIterator
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from config import Config
 
+# Perplexity chat roles for each LangChain message class
+MESSAGE_ROLES = {
+    SystemMessage: "system",
+    HumanMessage: "user",
+    AIMessage: "assistant"
+}
+
+# Retry backoff bounds (seconds)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+
+# Status codes worth retrying; any other non-200 fails immediately
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+# Consecutive failed attempts (across all instances) that open the circuit
+CIRCUIT_BREAKER_THRESHOLD = 5
+
+# Read size for streamed responses; larger reads mean fewer Python-level iterations
+STREAM_CHUNK_SIZE = 32768
+
+# SSE end-of-stream sentinel
+_DONE = b"[DONE]"
+
+def backoff_delay(attempt: int) -> float:
+    """Jittered exponential backoff for a zero-based attempt number"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * (0.5 + random.random())
+
+def retry_after_delay(response: httpx.Response, attempt: int) -> float:
+    """Delay requested by a Retry-After header (in seconds), else the computed backoff"""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # HTTP-date form; fall back to our own backoff
+    return backoff_delay(attempt)
+
+class PerplexityAPIError(Exception):
+    """Perplexity API failure that should not be retried any further"""
+
+class SSEDecoder:
+    """Incremental splitter for server-sent event `data:` lines read as raw bytes"""
+    
+    def __init__(self):
+        self._buffer = bytearray()
+    
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Add a raw chunk and return the payloads of all complete `data:` lines"""
+        buffer = self._buffer
+        buffer.extend(chunk)
+        
+        payloads = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            
+            line = bytes(buffer[start:end]).rstrip(b"\r")
+            start = end + 1
+            if line.startswith(b"data: "):
+                payloads.append(line[6:])  # Remove "data: " prefix
+        
+        # Drop consumed bytes once per chunk; a partial line stays for the next feed
+        del buffer[:start]
+        return payloads
+
 class PerplexityLLM:
     """Perplexity AI LLM integration using OpenAI-compatible API"""
     
+    # Circuit breaker state shared by all instances: after repeated failures,
+    # calls fail fast until the cool-down passes instead of piling up retries.
+    # Updated from request, streaming and summary threads, so guarded by a lock.
+    _fail_streak = 0
+    _circuit_open_until = 0.0
+    _breaker_lock = threading.Lock()
+    
     def __init__(self, api_key: str = None, model: str = "sonar-pro"):
         self.api_key = api_key or Config.PERPLEXITY_API_KEY
         self.model = model
@@ -18,154 +97,330 @@ class PerplexityLLM:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._configured = bool(self.api_key and self.api_key != "your_perplexity_api_key_here")
+        
+        # Long-lived pooled client so repeated calls reuse the TCP/TLS connection;
+        # auth and content-type headers are set once here rather than per request
+        self._client = httpx.Client(
+            http2=True,
+            headers=self.headers,
+            timeout=60.0,
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=60)
+        )
+        self._finalizer = weakref.finalize(self, self._client.close)
+        
+        # Async clients are bound to the event loop they were created in, so one is
+        # created lazily per running loop and forgotten when that loop goes away
+        self._aclients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+    
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self._finalizer()
     
     def is_configured(self) -> bool:
         """Check if Perplexity is properly configured"""
-        return bool(self.api_key and self.api_key != "your_perplexity_api_key_here")
+        return self._configured
     
     def _convert_messages(self, messages: List[BaseMessage]) -> List[Dict[str, str]]:
         """Convert LangChain messages to Perplexity format"""
         perplexity_messages = []
         
         for message in messages:
-            if isinstance(message, SystemMessage):
-                perplexity_messages.append({
-                    "role": "system",
-                    "content": message.content
-                })
-            elif isinstance(message, HumanMessage):
-                perplexity_messages.append({
-                    "role": "user", 
-                    "content": message.content
-                })
-            elif isinstance(message, AIMessage):
-                perplexity_messages.append({
-                    "role": "assistant",
-                    "content": message.content
-                })
+            role = MESSAGE_ROLES.get(type(message))
+            if role is None:
+                # Subclasses of the known message types miss the exact-type lookup
+                role = next((r for cls, r in MESSAGE_ROLES.items() if isinstance(message, cls)), None)
+                if role is None:
+                    continue  # Unsupported message types are skipped
+            
+            perplexity_messages.append({"role": role, "content": message.content})
         
         return perplexity_messages
     
-    def invoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
-        """Invoke the Perplexity API with retry logic"""
-        if not self.is_configured():
-            raise ValueError("Perplexity API key not configured")
-        
-        perplexity_messages = self._convert_messages(messages)
-        
-        payload = {
+    @classmethod
+    def _record_failure(cls):
+        with cls._breaker_lock:
+            cls._fail_streak += 1
+            if cls._fail_streak >= CIRCUIT_BREAKER_THRESHOLD:
+                cls._circuit_open_until = time.monotonic() + RETRY_MAX_DELAY
+    
+    @classmethod
+    def _record_success(cls):
+        with cls._breaker_lock:
+            cls._fail_streak = 0
+            cls._circuit_open_until = 0.0
+    
+    def _build_payload(self, messages: List[BaseMessage], stream: bool, **kwargs) -> Dict[str, Any]:
+        """Build the chat completions request body"""
+        return {
             "model": self.model,
-            "messages": perplexity_messages,
+            "messages": self._convert_messages(messages),
             "max_tokens": kwargs.get("max_tokens", 1000),
             "temperature": kwargs.get("temperature", 0.1),
             "top_p": kwargs.get("top_p", 1.0),
-            "stream": False
+            "stream": stream
         }
+    
+    def _check_available(self):
+        """Raise if the API key is missing or the circuit breaker is open"""
+        if not self.is_configured():
+            raise ValueError("Perplexity API key not configured")
+        
+        if time.monotonic() < PerplexityLLM._circuit_open_until:
+            raise PerplexityAPIError("Perplexity API temporarily unavailable after repeated failures")
+    
+    def _retry_delay_for_status(self, response: httpx.Response, attempt: int, max_retries: int) -> float:
+        """
+        Handle a non-200 response: raise if it is fatal or retries are exhausted,
+        otherwise return how long to wait before the next attempt
+        """
+        error_detail = response.text
+        
+        # Client errors such as 400/401/403 will not succeed on retry
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            raise PerplexityAPIError(f"Perplexity API error: {response.status_code} - {error_detail}")
+        
+        self._record_failure()
+        if attempt < max_retries - 1:
+            print(f"Perplexity API error (attempt {attempt + 1}): {response.status_code} - {error_detail}")
+            return retry_after_delay(response, attempt)
+        raise PerplexityAPIError(f"Perplexity API error: {response.status_code} - {error_detail}")
+    
+    @staticmethod
+    def _delta_content(data: bytes) -> Optional[str]:
+        """Extract the content delta from one streamed chunk, if any"""
+        try:
+            chunk = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return None
+        
+        if "choices" in chunk and len(chunk["choices"]) > 0:
+            return chunk["choices"][0].get("delta", {}).get("content")
+        return None
+    
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        """Invoke the Perplexity API with retry logic"""
+        self._check_available()
+        
+        # Encode once; every retry sends the same bytes
+        body = orjson.dumps(self._build_payload(messages, stream=False, **kwargs))
         
         # Retry logic for connection issues
         max_retries = 3
-        retry_delay = 2  # seconds
         
         for attempt in range(max_retries):
             try:
-                with httpx.Client(timeout=60.0) as client:  # Increased timeout
-                    response = client.post(
-                        self.base_url,
-                        headers=self.headers,
-                        json=payload,
-                        timeout=60.0
-                    )
-                    
-                    if response.status_code != 200:
-                        error_detail = response.text
-                        if attempt < max_retries - 1:
-                            print(f"Perplexity API error (attempt {attempt + 1}): {response.status_code} - {error_detail}")
-                            import time
-                            time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
-                            continue
-                        raise Exception(f"Perplexity API error: {response.status_code} - {error_detail}")
-                    
-                    result = response.json()
-                    content = result["choices"][0]["message"]["content"]
-                    
-                    return AIMessage(content=content)
+                response = self._client.post(
+                    self.base_url,
+                    content=body,
+                    timeout=60.0
+                )
+                
+                if response.status_code != 200:
+                    time.sleep(self._retry_delay_for_status(response, attempt, max_retries))
+                    continue
+                
+                result = orjson.loads(response.content)
+                content = result["choices"][0]["message"]["content"]
+                
+                self._record_success()
+                return AIMessage(content=content)
                     
-            except httpx.ConnectError as e:
+            except PerplexityAPIError:
+                raise
+            except httpx.HTTPError as e:
+                # Covers connect, timeout and other transport/protocol errors
+                self._record_failure()
                 if attempt < max_retries - 1:
-                    print(f"Connection error (attempt {attempt + 1}): {e}")
-                    import time
-                    time.sleep(retry_delay * (attempt + 1))
+                    print(f"{type(e).__name__} (attempt {attempt + 1}): {e}")
+                    time.sleep(backoff_delay(attempt))
                     continue
-                raise Exception(f"Perplexity API connection error: {e}")
-            except httpx.TimeoutException as e:
+                raise Exception(f"Perplexity API HTTP error: {e}")
+            except Exception as e:
                 if attempt < max_retries - 1:
-                    print(f"Timeout error (attempt {attempt + 1}): {e}")
-                    import time
-                    time.sleep(retry_delay * (attempt + 1))
+                    print(f"General error (attempt {attempt + 1}): {e}")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                raise Exception(f"Error calling Perplexity API: {e}")
+        
+        raise Exception("Perplexity API failed after all retry attempts")
+    
+    def stream(self, messages: List[BaseMessage], **kwargs):
+        """
+        Stream responses from Perplexity API. Failures before the first chunk are
+        retried like invoke; once text has been yielded an error is raised instead,
+        since a retry would repeat what the caller already received.
+        """
+        self._check_available()
+        
+        # Encode once; every retry sends the same bytes
+        body = orjson.dumps(self._build_payload(messages, stream=True, **kwargs))
+        
+        max_retries = 3
+        started = False
+        
+        for attempt in range(max_retries):
+            try:
+                with self._client.stream(
+                    "POST",
+                    self.base_url,
+                    content=body,
+                    timeout=30.0
+                ) as response:
+                    if response.status_code != 200:
+                        response.read()
+                        delay = self._retry_delay_for_status(response, attempt, max_retries)
+                    else:
+                        self._record_success()
+                        decoder = SSEDecoder()
+                        
+                        for raw_chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                            for data in decoder.feed(raw_chunk):
+                                if data == _DONE:
+                                    return
+                                
+                                content = self._delta_content(data)
+                                if content is not None:
+                                    started = True
+                                    yield content
+                        return
+                
+                # Wait outside the block so the connection goes back to the pool first
+                time.sleep(delay)
+                
+            except PerplexityAPIError:
+                raise
+            except httpx.HTTPError as e:
+                self._record_failure()
+                if not started and attempt < max_retries - 1:
+                    print(f"{type(e).__name__} (attempt {attempt + 1}): {e}")
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                raise Exception(f"Perplexity API streaming error: {e}")
+            except Exception as e:
+                raise Exception(f"Error streaming from Perplexity API: {e}")
+        
+        raise Exception("Perplexity API failed after all retry attempts")
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Return the running event loop's async client, creating it on first use in that loop"""
+        loop = asyncio.get_running_loop()
+        client = self._aclients.get(loop)
+        if client is None:
+            client = self._aclients[loop] = httpx.AsyncClient(
+                http2=True,
+                headers=self.headers,
+                timeout=60.0,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+            )
+        return client
+    
+    async def aclose(self):
+        """Close the running event loop's pooled async HTTP connections"""
+        client = self._aclients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    async def ainvoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        """Async variant of invoke, so several requests can be awaited concurrently"""
+        self._check_available()
+        
+        # Encode once; every retry sends the same bytes
+        body = orjson.dumps(self._build_payload(messages, stream=False, **kwargs))
+        client = self._get_async_client()
+        
+        # Retry logic for connection issues
+        max_retries = 3
+        
+        for attempt in range(max_retries):
+            try:
+                response = await client.post(
+                    self.base_url,
+                    content=body,
+                    timeout=60.0
+                )
+                
+                if response.status_code != 200:
+                    await asyncio.sleep(self._retry_delay_for_status(response, attempt, max_retries))
                     continue
-                raise Exception(f"Perplexity API timeout error: {e}")
+                
+                result = orjson.loads(response.content)
+                content = result["choices"][0]["message"]["content"]
+                
+                self._record_success()
+                return AIMessage(content=content)
+                
+            except PerplexityAPIError:
+                raise
             except httpx.HTTPError as e:
+                self._record_failure()
                 if attempt < max_retries - 1:
-                    print(f"HTTP error (attempt {attempt + 1}): {e}")
-                    import time
-                    time.sleep(retry_delay * (attempt + 1))
+                    print(f"{type(e).__name__} (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(backoff_delay(attempt))
                     continue
                 raise Exception(f"Perplexity API HTTP error: {e}")
             except Exception as e:
                 if attempt < max_retries - 1:
                     print(f"General error (attempt {attempt + 1}): {e}")
-                    import time
-                    time.sleep(retry_delay * (attempt + 1))
+                    await asyncio.sleep(backoff_delay(attempt))
                     continue
                 raise Exception(f"Error calling Perplexity API: {e}")
         
         raise Exception("Perplexity API failed after all retry attempts")
     
-    def stream(self, messages: List[BaseMessage], **kwargs):
-        """Stream responses from Perplexity API"""
-        if not self.is_configured():
-            raise ValueError("Perplexity API key not configured")
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[str]:
+        """Async variant of stream, with the same retry-before-first-chunk behavior"""
+        self._check_available()
         
-        perplexity_messages = self._convert_messages(messages)
+        # Encode once; every retry sends the same bytes
+        body = orjson.dumps(self._build_payload(messages, stream=True, **kwargs))
+        client = self._get_async_client()
         
-        payload = {
-            "model": self.model,
-            "messages": perplexity_messages,
-            "max_tokens": kwargs.get("max_tokens", 1000),
-            "temperature": kwargs.get("temperature", 0.1),
-            "top_p": kwargs.get("top_p", 1.0),
-            "stream": True
-        }
+        max_retries = 3
+        started = False
         
-        try:
-            with httpx.stream(
-                "POST",
-                self.base_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30.0
-            ) as response:
-                response.raise_for_status()
-                
-                for line in response.iter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]  # Remove "data: " prefix
-                        if data.strip() == "[DONE]":
-                            break
+        for attempt in range(max_retries):
+            try:
+                async with client.stream(
+                    "POST",
+                    self.base_url,
+                    content=body,
+                    timeout=30.0
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        delay = self._retry_delay_for_status(response, attempt, max_retries)
+                    else:
+                        self._record_success()
+                        decoder = SSEDecoder()
                         
-                        try:
-                            chunk = json.loads(data)
-                            if "choices" in chunk and len(chunk["choices"]) > 0:
-                                delta = chunk["choices"][0].get("delta", {})
-                                if "content" in delta:
-                                    yield delta["content"]
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except httpx.HTTPError as e:
-            raise Exception(f"Perplexity API streaming error: {e}")
-        except Exception as e:
-            raise Exception(f"Error streaming from Perplexity API: {e}")
+                        async for raw_chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                            for data in decoder.feed(raw_chunk):
+                                if data == _DONE:
+                                    return
+                                
+                                content = self._delta_content(data)
+                                if content is not None:
+                                    started = True
+                                    yield content
+                        return
+                
+                # Wait outside the block so the connection goes back to the pool first
+                await asyncio.sleep(delay)
+                
+            except PerplexityAPIError:
+                raise
+            except httpx.HTTPError as e:
+                self._record_failure()
+                if not started and attempt < max_retries - 1:
+                    print(f"{type(e).__name__} (attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                raise Exception(f"Perplexity API streaming error: {e}")
+            except Exception as e:
+                raise Exception(f"Error streaming from Perplexity API: {e}")
+        
+        raise Exception("Perplexity API failed after all retry attempts")
 
 # Example usage
 if __name__ == "__main__":
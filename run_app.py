@@ -1,7 +1,6 @@
 """
 Simple launcher for the Medical Appointment Scheduling AI Agent
 """
-import subprocess
 import sys
 import os
 
@@ -23,15 +22,14 @@ def main():
     print("📱 If it doesn't open automatically, copy the URL above to your browser")
     print("=" * 60)
     
+    # Flush before exec, the replaced process won't do it for us
+    sys.stdout.flush()
+    
     try:
-        # Run streamlit
-        subprocess.run([sys.executable, "-m", "streamlit", "run", "app.py"], check=True)
-    except KeyboardInterrupt:
-        print("\n🛑 Application stopped by user")
-    except subprocess.CalledProcessError as e:
+        # Replace this launcher with streamlit instead of waiting on a child process
+        os.execvp(sys.executable, [sys.executable, "-m", "streamlit", "run", "app.py"])
+    except OSError as e:
         print(f"❌ Error running application: {e}")
-    except Exception as e:
-        print(f"❌ Unexpected error: {e}")
 
 if __name__ == "__main__":
     main()
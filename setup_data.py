@@ -6,10 +6,14 @@ Creates necessary data files and directories
 
 import os
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-import json
+import orjson
 from faker import Faker
 
+# Shared generator so repeated calls reuse Faker's loaded locale/providers
+_FAKE = Faker()
+
 def create_data_directory():
     """Create data directory if it doesn't exist"""
     os.makedirs("data", exist_ok=True)
@@ -18,24 +22,25 @@ def create_data_directory():
 
 def create_sample_patients():
     """Create sample patient data"""
-    fake = Faker()
+    fake = _FAKE
     
-    patients_data = []
-    for i in range(10):  # Create 10 sample patients
-        patient = {
-            'id': f'P{str(i+1).zfill(3)}',
-            'first_name': fake.first_name(),
-            'last_name': fake.last_name(),
-            'date_of_birth': fake.date_of_birth(minimum_age=18, maximum_age=80),
-            'phone': fake.phone_number()[:10],  # Keep it simple
-            'email': fake.email(),
-            'address': fake.address(),
-            'emergency_contact': fake.name(),
-            'emergency_phone': fake.phone_number()[:10],
-            'patient_type': fake.random_element(elements=('new', 'returning')),
-            'created_at': datetime.now().isoformat()
-        }
-        patients_data.append(patient)
+    n = 10  # Create 10 sample patients
+    now = datetime.now().isoformat()
+    
+    # Build column lists directly so pandas doesn't hash a dict per row
+    patients_data = {
+        'id': [f'P{i+1:03d}' for i in range(n)],
+        'first_name': [fake.first_name() for _ in range(n)],
+        'last_name': [fake.last_name() for _ in range(n)],
+        'date_of_birth': [fake.date_of_birth(minimum_age=18, maximum_age=80) for _ in range(n)],
+        'phone': [fake.phone_number()[:10] for _ in range(n)],  # Keep it simple
+        'email': [fake.email() for _ in range(n)],
+        'address': [fake.address() for _ in range(n)],
+        'emergency_contact': [fake.name() for _ in range(n)],
+        'emergency_phone': [fake.phone_number()[:10] for _ in range(n)],
+        'patient_type': fake.random_elements(elements=('new', 'returning'), length=n),
+        'created_at': [now] * n
+    }
     
     # Save to CSV
     df = pd.DataFrame(patients_data)
@@ -57,58 +62,89 @@ def create_sample_doctors():
         'Sunday': ['Closed', 'Closed', 'Closed', 'Closed']
     }
     
-    df = pd.DataFrame(doctors_data)
-    df.to_excel("data/doctors_schedule.xlsx", index=False)
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    doctor_ids = [f'D{i+1:03d}' for i in range(len(doctors_data['Doctor']))]
+    
+    # One row per doctor, in the columns DatabaseManager.load_doctors reads
+    doctors = pd.DataFrame({
+        'id': doctor_ids,
+        'name': doctors_data['Doctor'],
+        'specialty': doctors_data['Specialty'],
+        'location': doctors_data['Location']
+    })
+    
+    # One row per bookable hour; closed days get no rows at all
+    schedule_rows = []
+    for i, doctor_id in enumerate(doctor_ids):
+        for day in days:
+            hours = doctors_data[day][i]
+            if hours == 'Closed':
+                continue
+            start, end = (int(part.split(':')[0]) for part in hours.split('-'))
+            for hour in range(start, end):
+                schedule_rows.append((doctor_id, day, hour, True))
+    schedule = pd.DataFrame(schedule_rows, columns=['doctor_id', 'day', 'hour', 'available'])
+    
+    # Plain CSV: far cheaper to write and read back than an Excel workbook
+    doctors.to_csv("data/doctors.csv", index=False)
+    schedule.to_csv("data/doctor_schedule.csv", index=False)
     print("✅ Created sample doctors schedule")
 
 def create_sample_appointments():
     """Create sample appointment data"""
+    today = date.today()
+    now_iso = datetime.now().isoformat()
+    
     appointments = []
     for i in range(5):  # Create 5 sample appointments
         appointment = {
-            'id': f'APT{str(i+1).zfill(3)}',
-            'patient_id': f'P{str(i+1).zfill(3)}',
-            'doctor_id': f'D{str((i%4)+1).zfill(3)}',
-            'appointment_date': (date.today() + timedelta(days=i+1)).isoformat(),
+            'id': f'APT{i+1:03d}',
+            'patient_id': f'P{i+1:03d}',
+            'doctor_id': f'D{(i%4)+1:03d}',
+            'appointment_date': (today + timedelta(days=i+1)).isoformat(),
             'appointment_time': f'{9+i}:00',
             'duration': 60 if i % 2 == 0 else 30,
             'status': 'scheduled',
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
+            'created_at': now_iso,
+            'updated_at': now_iso
         }
         appointments.append(appointment)
     
-    with open("data/appointments.json", "w") as f:
-        json.dump(appointments, f, indent=2)
+    with open("data/appointments.json", "wb") as f:
+        f.write(orjson.dumps(appointments, option=orjson.OPT_INDENT_2))
     print("✅ Created sample appointments data")
 
 def create_sample_reminders():
     """Create sample reminder data"""
+    now = datetime.now()
+    now_iso = now.isoformat()
+    
     reminders = []
     for i in range(3):  # Create 3 sample reminders
         reminder = {
-            'id': f'REM{str(i+1).zfill(3)}',
-            'patient_id': f'P{str(i+1).zfill(3)}',
-            'appointment_id': f'APT{str(i+1).zfill(3)}',
+            'id': f'REM{i+1:03d}',
+            'patient_id': f'P{i+1:03d}',
+            'appointment_id': f'APT{i+1:03d}',
             'reminder_type': 'initial',
-            'scheduled_time': (datetime.now() + timedelta(hours=i+1)).isoformat(),
+            'scheduled_time': (now + timedelta(hours=i+1)).isoformat(),
             'sent': False,
             'response': None,
-            'created_at': datetime.now().isoformat()
+            'created_at': now_iso
         }
         reminders.append(reminder)
     
-    with open("data/reminders.json", "w") as f:
-        json.dump(reminders, f, indent=2)
+    with open("data/reminders.json", "wb") as f:
+        f.write(orjson.dumps(reminders, option=orjson.OPT_INDENT_2))
     print("✅ Created sample reminders data")
 
 def create_log_files():
     """Create empty log files"""
     log_files = ["email_log.txt", "sms_log.txt"]
+    now_iso = datetime.now().isoformat()
     for log_file in log_files:
         with open(f"data/{log_file}", "w") as f:
             f.write(f"# {log_file} - Medical Scheduling Agent\n")
-            f.write(f"# Created: {datetime.now().isoformat()}\n\n")
+            f.write(f"# Created: {now_iso}\n\n")
         print(f"✅ Created {log_file}")
 
 def main():
@@ -116,12 +152,21 @@ def main():
     print("🚀 Setting up data for Medical Scheduling Agent...")
     
     try:
+        # Directories must exist before any writer runs
         create_data_directory()
-        create_sample_patients()
-        create_sample_doctors()
-        create_sample_appointments()
-        create_sample_reminders()
-        create_log_files()
+        
+        # Each writer produces its own independent file, so run them concurrently
+        writers = [
+            create_sample_patients,
+            create_sample_doctors,
+            create_sample_appointments,
+            create_sample_reminders,
+            create_log_files
+        ]
+        with ThreadPoolExecutor(max_workers=len(writers)) as executor:
+            futures = [executor.submit(writer) for writer in writers]
+        for future in futures:
+            future.result()  # Re-raise the first writer error, if any
         
         print("\n🎉 Data setup completed successfully!")
         print("📁 All data files created in the 'data/' directory")
@@ -3,8 +3,13 @@ Simplified Medical Appointment Scheduling AI Agent - Fixed for Perplexity API
 """
 import os
 import sys
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime, date, timedelta
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
 import re
 
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
@@ -14,11 +19,203 @@ from models import Patient, PatientType, Insurance, Appointment, AppointmentStat
 from database import DatabaseManager
 from tools import get_all_tools
 from emr_database import EMRDatabase
+from communication import EmailService, SMSService
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+# Number of recent messages sent to the LLM alongside the system prompt
+HISTORY_WINDOW = 20
+
+# Hard cap on retained messages (even, so trimming keeps user/assistant pairs).
+# Only reached when summaries keep failing, e.g. with no LLM available.
+MAX_HISTORY = HISTORY_WINDOW * 5
+
+# Turns to wait after a failed summary before trying again
+SUMMARY_RETRY_TURNS = 5
+
+def recent_window(history, size: int) -> List[Any]:
+    """
+    The last `size` messages of history, or fewer so that the window opens on a
+    user message: after the system messages, providers expect user/assistant turns
+    to alternate starting with the user.
+    """
+    start = max(0, len(history) - size)
+    while start < len(history) and not isinstance(history[start], HumanMessage):
+        start += 1
+    return list(islice(history, start, None))
+
+# Background conversation summaries for every agent in the process. Each agent
+# keeps at most one in flight, and a shared pool is never left to leak per session.
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# Instruction used to fold turns that leave the window into a running summary
+SUMMARY_PROMPT = (
+    "Summarize this appointment scheduling conversation for later context. "
+    "Preserve every patient fact (name, DOB, phone, email, doctor, location, "
+    "selected slot, insurance) and what is still missing. Be concise."
+)
+
+# Accepted date-of-birth formats: YYYY-MM-DD and MM/DD/YYYY
+DOB_ISO_PATTERN = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$")
+DOB_US_PATTERN = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+# Free-text extraction patterns, compiled once instead of per message
+PHONE_FIELD_PATTERN = re.compile(r'(\+?\d{1,3}[-.\s]?\d{3,4}[-.\s]?\d{3,4}[-.\s]?\d{3,4})')
+PHONE_PATTERN = re.compile(r"(\d{3}[-.]?\d{3}[-.]?\d{4})")
+EMAIL_PATTERN = re.compile(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})')
+PHONE_SEPARATORS = str.maketrans('', '', '+-.() \t\n\r\f\v')  # Deletes everything but digits from a phone match
+DIGIT_PATTERN = re.compile(r'\d')
+NAME_PATTERN = re.compile(r"(?:my name is|i'm|i am)\s+([a-zA-Z ]+)", re.IGNORECASE)
+DOB_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}|\d{1,2}/\d{1,2}/\d{4}|\d{1,2}-\d{1,2}-\d{4})")
+BORN_IN_PATTERN = re.compile(r"born in (\d{4})")
+DOCTOR_PATTERN = re.compile(r"(?:doctor|dr\.?|physician)\s+([a-zA-Z\s]+)", re.IGNORECASE)
+LOCATION_PATTERN = re.compile(r"\b(?:in|from|location|city|address)\s+([a-zA-Z][a-zA-Z\s]{1,40})", re.IGNORECASE)
+MEMBER_ID_PATTERN = re.compile(r"\b(?:member\s*)?id[:\s#]*([a-zA-Z0-9]{4,20})\b", re.IGNORECASE)
+# A bare alphanumeric token with at least one digit, e.g. a reply of just "ABC123456789"
+BARE_MEMBER_ID_PATTERN = re.compile(r"(?<![@.])\b(?=[a-zA-Z]*\d)([a-zA-Z0-9]{8,20})\b(?![@.])")
+GROUP_PATTERN = re.compile(r"\b(?:group(?:\s*number)?[:\s]*|number[:\s]*(?=\d{6}))(\d+)", re.IGNORECASE)
+
+# Slot selection: explicit times like "9:00 AM", "2:30", "3pm", and slot IDs
+SLOT_TIME_PATTERN = re.compile(r'\d{1,2}:\d{2}(?:\s*(?:AM|PM))?|\d{1,2}\s*(?:AM|PM)', re.IGNORECASE)
+SLOT_ID_PATTERN = re.compile(r'slot_\d+_\d+')
+
+# Bookable hours each weekday, morning then afternoon, with their display labels
+SLOT_HOURS = {9: "09:00 AM", 10: "10:00 AM", 11: "11:00 AM", 14: "02:00 PM", 15: "03:00 PM", 16: "04:00 PM"}
+
+# Common time expressions and the slot time each one stands for
+SLOT_TIME_EXPRESSIONS = {
+    'morning': '9:00 AM',
+    'afternoon': '2:00 PM',
+    'evening': '4:00 PM',
+    'first slot': '9:00 AM',
+    'second slot': '10:00 AM',
+    'third slot': '11:00 AM',
+    'lunch time': '12:00 PM',
+    'after lunch': '2:00 PM',
+    'last slot': '4:00 PM'
+}
+SLOT_TIME_EXPRESSION_PATTERN = re.compile(
+    r"\b(?:" + "|".join(re.escape(expr) for expr in SLOT_TIME_EXPRESSIONS) + ")", re.IGNORECASE
+)
+
+def parse_dob(value: str) -> Optional[date]:
+    """Parse a collected date of birth without going through strptime"""
+    if not value:
+        return None
+    try:
+        match = DOB_ISO_PATTERN.match(value)
+        if match:
+            return date(int(match[1]), int(match[2]), int(match[3]))
+        match = DOB_US_PATTERN.match(value)
+        if match:
+            return date(int(match[3]), int(match[1]), int(match[2]))
+    except ValueError:
+        pass  # Well-formed but not a real calendar date
+    return None
+
+def _keyword_pattern(*keywords: str) -> re.Pattern:
+    """Compile keywords into one alternation that matches any of them as a substring"""
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+@dataclass(slots=True)
+class PatientData:
+    """Patient details collected during the conversation; an empty string means not given yet"""
+    first_name: str = ""
+    last_name: str = ""
+    date_of_birth: str = ""
+    phone: str = ""
+    email: str = ""
+    doctor_preference: str = ""
+    location: str = ""
+    selected_slot: str = ""
+    insurance_carrier: str = ""
+    member_id: str = ""
+    group_number: str = ""
+    
+    def __bool__(self) -> bool:
+        """True once any field has been collected"""
+        return any(getattr(self, name) for name in self.__slots__)
+    
+    def to_dict(self) -> Dict[str, str]:
+        """The fields collected so far, keyed by name"""
+        return {name: value for name in self.__slots__ if (value := getattr(self, name))}
+
 class SimpleMedicalSchedulingAgent:
     """Simplified Medical Appointment Scheduling AI Agent"""
     
+    # Keyword matchers for intent routing, applied to the lowercased message.
+    # Each is a single C-level scan instead of one `in` check per keyword.
+    _EXPORT_KEYWORDS = _keyword_pattern("export", "excel", "download")
+    _REMINDER_KEYWORDS = _keyword_pattern("reminder", "remind", "notification")
+    _BOOKING_KEYWORDS = _keyword_pattern("book", "schedule", "appointment")
+    _BOOKING_OR_CONFIRM_KEYWORDS = _keyword_pattern("book", "schedule", "appointment", "confirm")
+    _GREETING_KEYWORDS = _keyword_pattern("hello", "hi", "hey", "start")
+    _SLOT_KEYWORDS = _keyword_pattern(
+        "select", "choose", "pick", "slot", "time", "9:", "10:", "11:", "2:", "3:", "4:", "5:",
+        "am", "pm", "morning", "afternoon", "evening"
+    )
+    
+    # Insurance carrier mentions, in priority order, mapped to the stored carrier name
+    _CARRIER_NAMES = {
+        "blue cross": "Blue Cross Blue Shield",
+        "bcbs": "Blue Cross Blue Shield",
+        "aetna": "Aetna",
+        "cigna": "Cigna",
+        "humana": "Humana"
+    }
+    
+    # Every free-form extractor trigger as one named group, so a single scan of the
+    # lowercased message tells which extractors have anything to look at
+    _FIELD_TRIGGERS = re.compile(
+        r"(?P<name>my name is|i'm)|(?P<digits>\d+)|(?P<email>@)|(?P<doctor>doctor|dr\.|physician)"
+        r"|(?P<carrier>" + "|".join(re.escape(keyword) for keyword in _CARRIER_NAMES) + ")"
+        r"|(?P<group>group|number)"
+    )
+    
+    # Message types shown in the chat history, and whether each came from the user
+    _IS_USER_MESSAGE = {HumanMessage: True, AIMessage: False}
+    
+    # (date, response) for the most recent slot listing, shared by all agents
+    _slots_cache: Optional[Tuple[date, str]] = None
+    
+    # Fields the patient must provide, with the label used when asking for them
+    _REQUIRED_INFO = (
+        ("first_name", "Name"),
+        ("date_of_birth", "DOB"),
+        ("phone", "Phone"),
+        ("email", "Email"),
+        ("doctor_preference", "Doctor preference"),
+        ("location", "Location"),
+        ("insurance_carrier", "Insurance details (Carrier, Member ID, Group)")
+    )
+    # Response sent after a successful booking and its automatic follow-up actions
+    _BOOKING_CONFIRMATION_TEMPLATE = (
+        "✅ Your appointment has been booked successfully! \n"
+        "\n"
+        "📱 **IMMEDIATE COMMUNICATIONS SENT:**\n"
+        "{communication}\n"
+        "\n"
+        "📊 **AUTOMATIC ACTIONS COMPLETED:**\n"
+        "{export}\n"
+        "\n"
+        "🔔 **REMINDER SYSTEM ACTIVATED:**\n"
+        "{reminder}"
+    )
+    
+    # MVP-1 requirements in collection order, driving the fallback state machine:
+    # (step, field it waits on). Booking is possible once none are missing.
+    _STEP_FIELDS = (
+        ("collect_name", "first_name"),
+        ("collect_dob", "date_of_birth"),
+        ("collect_phone", "phone"),
+        ("collect_email", "email"),
+        ("collect_doctor", "doctor_preference"),
+        ("collect_location", "location"),
+        ("select_slot", "selected_slot"),
+        ("collect_insurance", "insurance_carrier")
+    )
+    
     def __init__(self, api_key: str = None):
         # Use the provided API key or the hardcoded one
         api_key = api_key 
@@ -42,10 +239,52 @@ class SimpleMedicalSchedulingAgent:
         self.tools = get_all_tools()
         self.tool_lookup = {tool.name: tool for tool in self.tools}
         
-        # Conversation state
-        self.conversation_history = []
+        # Tools used on every booking, bound once; a missing one is a setup error
+        self._export_tool = self.tool_lookup["export_appointments"]
+        self._reminder_tool = self.tool_lookup["schedule_reminders"]
+        self._book_tool = self.tool_lookup["book_appointment"]
+        
+        # Long-lived communication clients, reused for every booking
+        self._email_service = EmailService()
+        self._sms_service = SMSService()
+        
+        # Conversation state. Turns leave the front only once a summary covering
+        # them has been produced; the prompt itself only carries the recent window
+        self.conversation_history = deque()
         self.current_step = "greeting"
-        self.collected_data = {}
+        self.collected_data = PatientData()
+        self._step_cache: Optional[str] = None  # None means collected_data changed
+        
+        # EMR lookups made during the current turn, keyed on (phone, email, first, last)
+        self._emr_cache: Dict[Tuple[str, str, str, str], Tuple[Any, str, int]] = {}
+        
+        # Free-form field extractors in application order, each with the _FIELD_TRIGGERS
+        # group that must match the lowercased message for it to run (None: always run)
+        self._field_extractors = (
+            ("name", self._extract_name),
+            ("digits", self._extract_date_of_birth),
+            ("digits", self._extract_phone),
+            ("email", self._extract_email),
+            ("doctor", self._extract_doctor),
+            (None, self._extract_location),
+            ("carrier", self._extract_insurance_carrier),
+            (None, self._extract_member_id),
+            ("group", self._extract_group_number)
+        )
+        
+        # Fallback response handler for each conversation step
+        self._step_handlers = {
+            "greeting": self._respond_greeting,
+            "collect_name": self._respond_collect_basics,
+            "collect_dob": self._respond_collect_basics,
+            "collect_phone": self._respond_collect_basics,
+            "collect_email": self._respond_collect_basics,
+            "collect_doctor": self._respond_collect_basics,
+            "collect_location": self._respond_collect_basics,
+            "select_slot": self._respond_select_slot,
+            "collect_insurance": self._respond_collect_insurance,
+            "ready": self._respond_ready
+        }
         
         # System prompt
         self.system_prompt = """You are a medical appointment scheduling AI assistant following MVP-1 requirements.
@@ -80,10 +319,102 @@ class SimpleMedicalSchedulingAgent:
         - Follow MVP-1 requirements exactly
         - When asking for insurance, be very clear: "I need your insurance information: Insurance Carrier, Member ID, and Group Number"
         - Don't proceed with booking until ALL information is collected including insurance"""
+        
+        # Messages that never change for the session. Sent first on every call and
+        # never mutated, so provider prompt caches can reuse the prefix
+        self.static_prefix = [SystemMessage(content=self.system_prompt)]
+        
+        # Running summary of turns compacted out of the window, produced off the request path
+        self._summary: Optional[str] = None
+        self._summary_message: Optional[SystemMessage] = None
+        self._summary_future: Optional[Future] = None
+        self._summary_covers = 0  # leading history messages the pending summary folds in
+        self._summary_backoff = 0  # turns to wait before retrying a failed summary
+    
+    def _set_summary(self, summary: Optional[str]):
+        """Store the running summary and the message that carries it, built once per change"""
+        self._summary = summary
+        self._summary_message = SystemMessage(content=f"Conversation so far: {summary}") if summary else None
+    
+    def _collect_summary(self):
+        """Apply a finished background summary and drop the messages it folded in"""
+        future = self._summary_future
+        if future is None or not future.done():
+            return
+        self._summary_future = None
+        
+        # On failure the messages stay put and are retried after a few more
+        # turns, rather than on every turn while the LLM is unavailable
+        summary = future.result()
+        if summary is None:
+            self._summary_backoff = SUMMARY_RETRY_TURNS
+            return
+        self._set_summary(summary)
+        for _ in range(self._summary_covers):
+            self.conversation_history.popleft()
+    
+    def _context_messages(self) -> List[Any]:
+        """Build the LLM input: static prefix, summary of older turns, recent turns"""
+        self._collect_summary()
+        
+        # Copy the prefix, then one C-level extend for the summary and recent turns.
+        # History only outgrows the window while a summary is pending or failing.
+        messages = list(self.static_prefix)
+        if self._summary_message is not None:
+            messages.append(self._summary_message)
+        messages.extend(recent_window(self.conversation_history, HISTORY_WINDOW))
+        return messages
+    
+    def _summarize(self, previous_summary: Optional[str], older_messages: List[Any]) -> Optional[str]:
+        """Fold older messages into the running summary; None if the LLM call fails"""
+        messages = [SystemMessage(content=SUMMARY_PROMPT)]
+        if previous_summary:
+            messages.append(SystemMessage(content=f"Earlier summary: {previous_summary}"))
+        messages.extend(older_messages)
+        
+        try:
+            response = self.llm.invoke(messages)
+            return response.content if hasattr(response, 'content') else str(response)
+        except Exception as e:
+            logger.warning("Conversation summary failed, keeping messages for a retry: %s", e)
+            return None
+    
+    def _compact_history(self):
+        """Summarize all but the recent half-window in the background once the window is nearly full"""
+        if len(self.conversation_history) < HISTORY_WINDOW - 2:
+            return
+        
+        # Only one summary in flight; a pending one is picked up on a later turn
+        self._collect_summary()
+        if self._summary_future is not None:
+            return
+        
+        # Summaries keep failing: drop the oldest turns past the hard cap, which
+        # is safe now that no pending summary refers to the front of the history
+        history = self.conversation_history
+        for _ in range(len(history) - MAX_HISTORY):
+            history.popleft()
+        
+        if self._summary_backoff:
+            self._summary_backoff -= 1
+            return
+        
+        # Messages stay in the history until the summary succeeds, so a failed
+        # or slow summary never loses turns; older backlog is included on retry
+        self._summary_covers = len(self.conversation_history) - HISTORY_WINDOW // 2
+        older_messages = list(islice(self.conversation_history, self._summary_covers))
+        self._summary_future = _SUMMARY_EXECUTOR.submit(self._summarize, self._summary, older_messages)
     
     def process_message(self, message: str) -> str:
         """Process a user message and return AI response"""
+        return "".join(self.stream_message(message))
+    
+    def stream_message(self, message: str) -> Iterator[str]:
+        """Process a user message and yield the AI response as it is produced"""
         try:
+            # EMR results are only reused within a turn, so a record added meanwhile is seen next time
+            self._emr_cache.clear()
+            
             # Add user message to conversation history
             self.conversation_history.append(HumanMessage(content=message))
             
@@ -92,44 +423,54 @@ class SimpleMedicalSchedulingAgent:
             
             # Check if we have complete booking info and should trigger booking immediately
             if self._has_complete_booking_info():
-                # Show EMR lookup process
-                emr_lookup_result = self._perform_emr_lookup()
+                # Show EMR lookup process; booking has already started this turn's lookup,
+                # so the summary reuses its cached result instead of querying again
                 booking_result = self._handle_appointment_booking()
-                return f"✅ Perfect! I have all your information. Let me check our records and book your appointment now.\n\n{emr_lookup_result}\n\n{booking_result}"
-            
-            # Check if we have basic info to show available slots (only if not selecting appointment)
-            
-            # Build messages for API call
-            messages = [SystemMessage(content=self.system_prompt)]
+                emr_lookup_result = self._perform_emr_lookup()
+                yield f"✅ Perfect! I have all your information. Let me check our records and book your appointment now.\n\n{emr_lookup_result}\n\n{booking_result}"
+                return
             
-            # Add conversation history (ensuring proper alternation)
-            for msg in self.conversation_history:
-                messages.append(msg)
+            # Build messages for API call: stable prefix, then recent turns appended at the tail
+            messages = self._context_messages()
             
-            # Get AI response with fallback
+            # Stream the AI response with fallback
+            streamed = []
             try:
-                # Try API call
-                response = self.llm.invoke(messages)
-                ai_message = response.content if hasattr(response, 'content') else str(response)
+                for chunk in self.llm.stream(messages):
+                    # PerplexityLLM yields text, LangChain chat models yield message chunks
+                    text = chunk if isinstance(chunk, str) else chunk.content
+                    if text:
+                        streamed.append(text)
+                        yield text
                 
-                # Check if the response contains tool usage requests
-                ai_message = self._check_and_execute_tools(ai_message, message)
+                ai_message = "".join(streamed)
+                
+                # Check if the user message requires tool execution; results are appended after the reply
+                full_message = self._check_and_execute_tools(ai_message, message)
+                if len(full_message) > len(ai_message):
+                    yield full_message[len(ai_message):]
+                ai_message = full_message
                 
             except Exception as api_error:
                 # Fallback to a simple rule-based response if API fails
-                ai_message = self._get_fallback_response(message)
-                print(f"API Error, using fallback: {api_error}")
+                fallback = self._get_fallback_response(message)
+                logger.warning("API Error, using fallback: %s", api_error)
+                
+                # Anything already shown stays; the fallback follows it
+                if streamed:
+                    fallback = "\n\n" + fallback
+                yield fallback
+                ai_message = "".join(streamed) + fallback
             
             # Add AI response to conversation history
             self.conversation_history.append(AIMessage(content=ai_message))
-            
-            return ai_message
+            self._compact_history()
             
         except Exception as e:
             # Always return a response, even if there's an error
             error_message = f"I'm here to help you schedule an appointment. Please provide: Name, DOB, Phone, Email, Doctor preference, and Location."
             self.conversation_history.append(AIMessage(content=error_message))
-            return error_message
+            yield error_message
     
     def _check_and_execute_tools(self, ai_message: str, user_message: str) -> str:
         """Check if the user message requires tool execution and execute if needed"""
@@ -137,17 +478,17 @@ class SimpleMedicalSchedulingAgent:
         
         
         # Check for export requests
-        if any(word in message_lower for word in ["export", "excel", "download"]):
+        if self._EXPORT_KEYWORDS.search(message_lower):
             export_result = self._handle_export_request()
             return f"{ai_message}\n\n{export_result}"
         
         # Check for reminder requests
-        elif any(word in message_lower for word in ["reminder", "remind", "notification", "send reminder"]):
+        elif self._REMINDER_KEYWORDS.search(message_lower):
             reminder_result = self._handle_reminder_request()
             return f"{ai_message}\n\n{reminder_result}"
         
         # Check for booking requests
-        elif any(word in message_lower for word in ["book", "schedule", "appointment", "confirm"]):
+        elif self._BOOKING_OR_CONFIRM_KEYWORDS.search(message_lower):
             booking_result = self._handle_appointment_booking()
             return f"{ai_message}\n\n{booking_result}"
         
@@ -158,34 +499,48 @@ class SimpleMedicalSchedulingAgent:
         
         return ai_message
     
+    def _set_field(self, key: str, value: Any):
+        """Store a collected value and invalidate the cached conversation step"""
+        setattr(self.collected_data, key, value)
+        self._step_cache = None
+    
     def _has_complete_booking_info(self) -> bool:
         """Check if we have enough information to automatically book an appointment"""
-        # MVP-1 requirements: Name, DOB, Phone, Email, Doctor preference, Location, Selected Slot, Insurance
-        required_fields = ["first_name", "date_of_birth", "phone", "email", "doctor_preference", "location", "selected_slot", "insurance_carrier"]
-        return all(self.collected_data.get(field) for field in required_fields)
+        return self._next_step() == "ready"
+    
+    def _lookup_patient(self, phone: str, email: str, first_name: str, last_name: str) -> Tuple[Any, str, int]:
+        """Patient record, patient type and smart duration from the EMR"""
+        patient_record, patient_type = self.emr_db.detect_patient_type(
+            phone=phone, email=email,
+            first_name=first_name,
+            last_name=last_name
+        )
+        duration = self.emr_db.get_smart_duration(patient_record, patient_type)
+        return patient_record, patient_type, duration
+    
+    def _emr_lookup_cached(self, phone: str, email: str, first_name: str, last_name: str) -> Tuple[Any, str, int]:
+        """Patient record, patient type and smart duration, looked up at most once per turn for the same identity"""
+        key = (phone, email, first_name, last_name)
+        result = self._emr_cache.get(key)
+        if result is None:
+            result = self._emr_cache[key] = self._lookup_patient(*key)
+        return result
     
     def _perform_emr_lookup(self) -> str:
         """Perform EMR lookup and return user-friendly result"""
         try:
             # Get phone and email from collected data
-            phone = self.collected_data.get("phone")
-            email = self.collected_data.get("email")
-            first_name = self.collected_data.get("first_name")
-            last_name = self.collected_data.get("last_name", "Patient")
-            
-            # Perform EMR lookup
-            patient_record, patient_type = self.emr_db.detect_patient_type(
-                phone=phone, email=email, 
-                first_name=first_name,
-                last_name=last_name
-            )
+            phone = self.collected_data.phone
+            email = self.collected_data.email
+            first_name = self.collected_data.first_name
+            last_name = self.collected_data.last_name or "Patient"
             
-            # Get smart duration
-            duration = self.emr_db.get_smart_duration(patient_record, patient_type)
+            # Perform EMR lookup and get smart duration
+            patient_record, patient_type, duration = self._emr_lookup_cached(phone, email, first_name, last_name)
             
             # Format result for user
             if patient_record:
-                return f"🔍 **EMR Lookup Complete:**\nFound existing patient record for {patient_record.get('first_name', '')} {patient_record.get('last_name', '')}\n✅ **Patient Type:** {patient_type.title()}\n📅 **Appointment Duration:** {duration} minutes"
+                return f"🔍 **EMR Lookup Complete:**\nFound existing patient record for {patient_record.first_name} {patient_record.last_name}\n✅ **Patient Type:** {patient_type.title()}\n📅 **Appointment Duration:** {duration} minutes"
             else:
                 return f"🔍 **EMR Lookup Complete:**\nNo existing record found in our system\n✅ **Patient Type:** {patient_type.title()}\n📅 **Appointment Duration:** {duration} minutes"
                 
@@ -194,164 +549,83 @@ class SimpleMedicalSchedulingAgent:
     
     
     
+    def _next_step(self) -> str:
+        """Conversation step implied by the first required field still missing, cached until collected_data changes"""
+        if self._step_cache is None:
+            self._step_cache = self._classify_step()
+        return self._step_cache
+    
+    def _classify_step(self) -> str:
+        """Scan collected_data in collection order and stop at the first gap"""
+        if not self.collected_data:
+            return "greeting"
+        for step, field in self._STEP_FIELDS:
+            if not getattr(self.collected_data, field):
+                return step
+        return "ready"
+    
     def _get_fallback_response(self, message: str) -> str:
         """Provide a fallback response when API is unavailable"""
         message_lower = message.lower()
         
-        # FIRST: Extract information and check if we have complete booking info
-        self._extract_information(message)
-        if self._has_complete_booking_info():
-            booking_result = self._handle_appointment_booking()
-            return f"✅ Perfect! I have all your information. Let me book your appointment now.\n\n{booking_result}"
-        
-        # Check for tool usage requests
-        if any(word in message_lower for word in ["export", "excel", "download"]):
+        # Explicit tool requests take priority over the collection flow
+        if self._EXPORT_KEYWORDS.search(message_lower):
             return self._handle_export_request()
         
-        elif any(word in message_lower for word in ["reminder", "remind", "notification"]):
+        elif self._REMINDER_KEYWORDS.search(message_lower):
             return self._handle_reminder_request()
         
-        elif any(word in message_lower for word in ["book", "schedule", "appointment"]):
+        elif self._BOOKING_KEYWORDS.search(message_lower):
             return self._handle_appointment_booking()
         
+        # Information was already extracted by process_message; route on what is still missing
+        self.current_step = self._next_step()
+        return self._step_handlers[self.current_step](message)
+    
+    def _is_repeated_greeting(self, message: str) -> bool:
+        """True for a hello after the conversation is already underway (prevents loops)"""
+        return len(self.conversation_history) > 2 and bool(self._GREETING_KEYWORDS.search(message.lower()))
+    
+    def _respond_greeting(self, message: str) -> str:
+        """Welcome the patient, or nudge them on if they keep greeting"""
+        if self._is_repeated_greeting(message):
+            return "I'm still here to help! What information do you need to provide next?"
+        return "🏥 **Welcome to Medical Appointment Scheduling!**\n\nI'll help you book an appointment quickly. Here's what I need:\n\n**📋 REQUIRED INFORMATION:**\n• Full name\n• Date of birth\n• Phone number\n• Email address\n• Doctor preference\n• Location preference\n• **Insurance details** (Carrier, Member ID, Group Number)\n\nPlease start by providing your name and date of birth."
+    
+    def _respond_collect_basics(self, message: str) -> str:
+        """Ask for whichever required details are still missing"""
+        if self._is_repeated_greeting(message):
+            return "I'm still here to help! What information do you need to provide next?"
         
-        # Check if we have basic info but need to show available slots
-        if (self.collected_data.get("first_name") and 
-            self.collected_data.get("date_of_birth") and 
-            self.collected_data.get("phone") and 
-            self.collected_data.get("email") and 
-            self.collected_data.get("doctor_preference") and 
-            self.collected_data.get("location") and 
-            not self.collected_data.get("selected_slot")):
-            return self._show_available_slots()
-        
-        # Check if we have most information but missing insurance
-        if (self.collected_data.get("first_name") and 
-            self.collected_data.get("date_of_birth") and 
-            self.collected_data.get("phone") and 
-            self.collected_data.get("email") and 
-            self.collected_data.get("doctor_preference") and 
-            self.collected_data.get("location") and 
-            self.collected_data.get("selected_slot") and
-            not self.collected_data.get("insurance_carrier")):
-            return "✅ Perfect! I have all your basic information and selected time slot.\n\n📋 **INSURANCE INFORMATION REQUIRED:**\nI need your insurance details to complete the booking:\n• Insurance Carrier (e.g., Blue Cross, Aetna, Cigna)\n• Member ID\n• Group Number\n\nPlease provide all three pieces of information so I can book your appointment and send confirmations."
-        
-        # Check if this is a repetitive greeting (prevent loops)
-        if len(self.conversation_history) > 2:
-            # If we've had multiple exchanges, be more specific
-            if any(word in message_lower for word in ["hello", "hi", "hey", "start"]):
-                return "I'm still here to help! What information do you need to provide next?"
-        
-        # Check if we have complete booking info and should trigger booking immediately
-        if self._has_complete_booking_info():
-            booking_result = self._handle_appointment_booking()
-            return f"✅ Perfect! I have all your information. Let me book your appointment now.\n\n{booking_result}"
-        
-        
-        # MVP-1 compliant responses
-        elif any(word in message_lower for word in ["hello", "hi", "hey", "start"]):
-            return "🏥 **Welcome to Medical Appointment Scheduling!**\n\nI'll help you book an appointment quickly. Here's what I need:\n\n**📋 REQUIRED INFORMATION:**\n• Full name\n• Date of birth\n• Phone number\n• Email address\n• Doctor preference\n• Location preference\n• **Insurance details** (Carrier, Member ID, Group Number)\n\nPlease start by providing your name and date of birth."
-        
-        elif any(word in message_lower for word in ["name", "i'm", "i am", "my name"]):
-            if not self.collected_data.get("first_name"):
-                return "Thank you. I need: DOB, Phone, Email, Doctor preference, and Location."
-            else:
-                return "I have your name. What other information do you need to provide?"
-        
-        elif any(word in message_lower for word in ["birth", "born", "dob"]):
-            if not self.collected_data.get("date_of_birth"):
-                return "Got it. Need: Phone, Email, Doctor preference, and Location."
-            else:
-                return "I have your DOB. What other information do you need to provide?"
-        
-        elif any(word in message_lower for word in ["phone", "number", "call", "mobile"]):
-            if not self.collected_data.get("phone"):
-                return "Thanks. Need: Email, Doctor preference, and Location."
-            else:
-                return "I have your phone number. What other information do you need to provide?"
-        
-        elif any(word in message_lower for word in ["email", "mail", "@"]):
-            if not self.collected_data.get("email"):
-                return "Good. Need: Doctor preference and Location."
-            else:
-                return "I have your email. What other information do you need to provide?"
-        
-        elif any(word in message_lower for word in ["doctor", "physician", "specialist"]):
-            if not self.collected_data.get("doctor_preference"):
-                return "Thanks. Just need your Location."
-            else:
-                return "I have your doctor preference. What other information do you need to provide?"
-        
-        elif any(word in message_lower for word in ["location", "address", "city", "where"]):
-            if not self.collected_data.get("location"):
-                return "Perfect! Now I need your insurance details: Carrier, Member ID, and Group number."
-            else:
-                return "I have your location. Now I need your insurance details: Carrier, Member ID, and Group number."
-        
-        
-        
-        # Handle slot selection
-        elif any(word in message_lower for word in ["select", "choose", "pick", "slot", "time", "9:", "10:", "11:", "2:", "3:", "4:", "5:", "am", "pm", "morning", "afternoon", "evening"]) and self.collected_data.get("doctor_preference") and self.collected_data.get("location"):
-            # Extract slot selection from message
+        missing_info = [label for field, label in self._REQUIRED_INFO if not getattr(self.collected_data, field)]
+        return f"I still need: {', '.join(missing_info)}. Please provide the missing information."
+    
+    def _respond_select_slot(self, message: str) -> str:
+        """Record the chosen slot, or list the available ones"""
+        if self._SLOT_KEYWORDS.search(message.lower()):
             selected_slot = self._extract_slot_selection(message)
             if selected_slot:
-                self.collected_data["selected_slot"] = selected_slot
+                self._set_field("selected_slot", selected_slot)
                 return f"✅ Great! You've selected: {selected_slot}\n\nNow I need your insurance information: Carrier, Member ID, and Group number."
-            else:
-                return "I need you to specify which time slot you'd like. Please tell me the exact time (e.g., '9:00 AM' or '2:00 PM')."
-        
-        elif any(word in message_lower for word in ["insurance", "coverage", "payment"]):
-            if not self.collected_data.get("insurance_carrier"):
-                return "I need your insurance details: Carrier, Member ID, and Group number. Once you provide this, I'll automatically book your appointment and send confirmations."
-            else:
-                return "I have your insurance information. Let me book your appointment now!"
-        
-        elif any(word in message_lower for word in ["wait", "moment", "retrieve", "slots", "looking", "searching"]):
-            # Handle the case where system is looking up records
-            if self._has_complete_booking_info():
-                booking_result = self._handle_appointment_booking()
-                return f"✅ I've found your records and scheduled your appointment!\n\n{booking_result}"
-            else:
-                return "I'm checking our system for available slots. Please provide your insurance details to complete the booking."
-        
-        else:
-            # Check what information we still need
-            missing_info = []
-            if not self.collected_data.get("first_name"):
-                missing_info.append("Name")
-            if not self.collected_data.get("date_of_birth"):
-                missing_info.append("DOB")
-            if not self.collected_data.get("phone"):
-                missing_info.append("Phone")
-            if not self.collected_data.get("email"):
-                missing_info.append("Email")
-            if not self.collected_data.get("doctor_preference"):
-                missing_info.append("Doctor preference")
-            if not self.collected_data.get("location"):
-                missing_info.append("Location")
-            if not self.collected_data.get("insurance_carrier"):
-                missing_info.append("Insurance details (Carrier, Member ID, Group)")
-            
-            if missing_info:
-                if len(missing_info) == 1 and "Insurance details" in missing_info[0]:
-                    return "Perfect! I have all your basic information. Now I need your insurance details: Carrier, Member ID, and Group number. Once you provide this, I'll automatically book your appointment and send confirmations."
-                else:
-                    return f"I still need: {', '.join(missing_info)}. Please provide the missing information."
-            else:
-                return "I have all your information! Let me book your appointment now."
+        return self._show_available_slots()
+    
+    def _respond_collect_insurance(self, message: str) -> str:
+        """Ask for the mandatory insurance details"""
+        return "✅ Perfect! I have all your basic information and selected time slot.\n\n📋 **INSURANCE INFORMATION REQUIRED:**\nI need your insurance details to complete the booking:\n• Insurance Carrier (e.g., Blue Cross, Aetna, Cigna)\n• Member ID\n• Group Number\n\nPlease provide all three pieces of information so I can book your appointment and send confirmations."
+    
+    def _respond_ready(self, message: str) -> str:
+        """Everything is collected, so book"""
+        booking_result = self._handle_appointment_booking()
+        return f"✅ Perfect! I have all your information. Let me book your appointment now.\n\n{booking_result}"
     
     def _handle_export_request(self) -> str:
         """Handle Excel export requests"""
         try:
-            export_tool = self.tool_lookup.get("export_appointments")
-            if export_tool:
-                result = export_tool._run()
-                if result.startswith("SUCCESS"):
-                    return "✅ Your appointment has been exported to Excel successfully! The file has been saved to the data directory."
-                else:
-                    return f"❌ There was an issue exporting to Excel: {result}"
+            result = self._export_tool._run()
+            if result.startswith("SUCCESS"):
+                return "✅ Your appointment has been exported to Excel successfully! The file has been saved to the data directory."
             else:
-                return "❌ Export tool not available. Please try again later."
+                return f"❌ There was an issue exporting to Excel: {result}"
         except Exception as e:
             return f"❌ Error exporting to Excel: {str(e)}"
     
@@ -359,21 +633,17 @@ class SimpleMedicalSchedulingAgent:
         """Handle reminder scheduling requests"""
         try:
             # Check if we have enough data to schedule reminders
-            if not self.collected_data.get("first_name") or not self.collected_data.get("date_of_birth"):
+            if not self.collected_data.first_name or not self.collected_data.date_of_birth:
                 return "I need your name and appointment date to schedule reminders. Please provide your full name and when you'd like to schedule your appointment."
             
-            # Create a test appointment for reminder scheduling
-            from datetime import date, timedelta
-            from models import Patient, Appointment, AppointmentStatus
-            
             # Create patient object
             patient = Patient(
                 id="TEMP001",
-                first_name=self.collected_data.get("first_name", "Patient"),
-                last_name=self.collected_data.get("last_name", "Name"),
+                first_name=self.collected_data.first_name or "Patient",
+                last_name=self.collected_data.last_name or "Name",
                 date_of_birth=date.today() - timedelta(days=365*30),  # Default age
-                phone=self.collected_data.get("phone", "555-000-0000"),
-                email=self.collected_data.get("email", "patient@example.com"),
+                phone=self.collected_data.phone or "555-000-0000",
+                email=self.collected_data.email or "patient@example.com",
                 address="123 Main St",
                 emergency_contact="Emergency Contact",
                 emergency_phone="555-000-0001",
@@ -392,20 +662,16 @@ class SimpleMedicalSchedulingAgent:
             )
             
             # Schedule reminders
-            reminder_tool = self.tool_lookup.get("schedule_reminders")
-            if reminder_tool:
-                result = reminder_tool._run(
-                    appointment_id="APT001",
-                    patient_id="TEMP001",
-                    appointment_date="2025-09-04",
-                    appointment_time="10:00"
-                )
-                if result.startswith("SUCCESS"):
-                    return "✅ Reminders have been scheduled successfully! You'll receive SMS reminders 24 hours, 2 hours, and 1 hour before your appointment."
-                else:
-                    return f"❌ There was an issue scheduling reminders: {result}"
+            result = self._reminder_tool._run(
+                appointment_id="APT001",
+                patient_id="TEMP001",
+                appointment_date="2025-09-04",
+                appointment_time="10:00"
+            )
+            if result.startswith("SUCCESS"):
+                return "✅ Reminders have been scheduled successfully! You'll receive SMS reminders 24 hours, 2 hours, and 1 hour before your appointment."
             else:
-                return "❌ Reminder tool not available. Please try again later."
+                return f"❌ There was an issue scheduling reminders: {result}"
         except Exception as e:
             return f"❌ Error scheduling reminders: {str(e)}"
     
@@ -414,18 +680,14 @@ class SimpleMedicalSchedulingAgent:
         try:
             # Check if we have enough data
             required_fields = ["first_name", "date_of_birth", "phone"]
-            missing_fields = [field for field in required_fields if not self.collected_data.get(field)]
+            missing_fields = [field for field in required_fields if not getattr(self.collected_data, field)]
             
             if missing_fields:
                 return f"I need more information to book your appointment. Please provide: {', '.join(missing_fields)}"
             
-            # Create patient and appointment
-            from datetime import date, timedelta
-            from models import Patient, Appointment, AppointmentStatus
-            
             # Get email and phone from collected data
-            email = self.collected_data.get("email")
-            phone = self.collected_data.get("phone")
+            email = self.collected_data.email
+            phone = self.collected_data.phone
             
             # Replace example emails/phones with real ones if needed
             if email and "example" in email.lower():
@@ -434,48 +696,40 @@ class SimpleMedicalSchedulingAgent:
                 phone = "+919826145342"  # Use real phone for testing
             
             # Generate unique patient ID
-            existing_patients = self.db.load_patients()
-            patient_id = f"P{str(len(existing_patients) + 1).zfill(4)}"
+            patient_id = self.db.next_patient_id()
             
             # Parse date of birth
-            try:
-                if "-" in self.collected_data.get("date_of_birth", ""):
-                    dob = datetime.strptime(self.collected_data.get("date_of_birth"), '%Y-%m-%d').date()
-                elif "/" in self.collected_data.get("date_of_birth", ""):
-                    dob = datetime.strptime(self.collected_data.get("date_of_birth"), '%m/%d/%Y').date()
-                else:
-                    dob = date.today() - timedelta(days=365*30)  # Default age
-            except:
+            dob = parse_dob(self.collected_data.date_of_birth)
+            if dob is None:
                 dob = date.today() - timedelta(days=365*30)  # Default age
             
             # Determine patient type using EMR
-            print(f"🔍 EMR Lookup: Checking patient records for {self.collected_data.get('first_name')} {self.collected_data.get('last_name', 'Patient')}")
-            print(f"   Phone: {phone}")
-            print(f"   Email: {email}")
-            
-            patient_record, patient_type = self.emr_db.detect_patient_type(
-                phone=phone, email=email, 
-                first_name=self.collected_data.get("first_name"),
-                last_name=self.collected_data.get("last_name", "Patient")
-            )
+            logger.debug("🔍 EMR Lookup: Checking patient records for %s %s (phone %s, email %s)",
+                         self.collected_data.first_name, self.collected_data.last_name or "Patient",
+                         phone, email)
             
-            print(f"✅ EMR Result: Patient classified as '{patient_type}'")
-            if patient_record:
-                print(f"   Found existing record: {patient_record.get('first_name', '')} {patient_record.get('last_name', '')}")
-            else:
-                print(f"   No existing record found - new patient")
+            patient_record, patient_type, duration = self._emr_lookup_cached(
+                phone, email,
+                self.collected_data.first_name,
+                self.collected_data.last_name or "Patient"
+            )
             
-            # Get smart duration
-            duration = self.emr_db.get_smart_duration(patient_record, patient_type)
-            print(f"📅 Smart Scheduling: Assigned {duration} minutes ({'new patient' if patient_type == 'new' else 'returning patient'})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("✅ EMR Result: Patient classified as '%s'", patient_type)
+                if patient_record:
+                    logger.debug("   Found existing record: %s %s", patient_record.first_name, patient_record.last_name)
+                else:
+                    logger.debug("   No existing record found - new patient")
+                logger.debug("📅 Smart Scheduling: Assigned %s minutes (%s)", duration,
+                             'new patient' if patient_type == 'new' else 'returning patient')
             
             patient = Patient(
                 id=patient_id,
-                first_name=self.collected_data.get("first_name"),
-                last_name=self.collected_data.get("last_name", "Patient"),
+                first_name=self.collected_data.first_name,
+                last_name=self.collected_data.last_name or "Patient",
                 date_of_birth=dob,
                 phone=phone,
-                email=self.collected_data.get("email", "patient@example.com"),
+                email=self.collected_data.email or "patient@example.com",
                 address="123 Main St",
                 emergency_contact="Emergency Contact",
                 emergency_phone="555-000-0001",
@@ -486,8 +740,7 @@ class SimpleMedicalSchedulingAgent:
             self.db.add_new_patient(patient)
             
             # Generate unique appointment ID
-            existing_appointments = self.db.load_appointments()
-            appointment_id = f"APT{str(len(existing_appointments) + 1).zfill(4)}"
+            appointment_id = self.db.next_appointment_id()
             
             appointment = Appointment(
                 id=appointment_id,
@@ -500,71 +753,64 @@ class SimpleMedicalSchedulingAgent:
             )
             
             # Book appointment
-            book_tool = self.tool_lookup.get("book_appointment")
-            if book_tool:
-                result = book_tool._run(
-                    patient_id=patient_id,
-                    doctor_id="D001",
-                    appointment_date=appointment.appointment_date.strftime('%Y-%m-%d'),
-                    appointment_time=appointment.appointment_time,
-                    duration=duration,
-                    insurance_carrier=self.collected_data.get("insurance_carrier"),
-                    insurance_member_id=self.collected_data.get("member_id"),
-                    insurance_group=self.collected_data.get("group_number")
+            result = self._book_tool._run(
+                patient_id=patient_id,
+                doctor_id="D001",
+                appointment_date=appointment.appointment_date.strftime('%Y-%m-%d'),
+                appointment_time=appointment.appointment_time,
+                duration=duration,
+                insurance_carrier=self.collected_data.insurance_carrier or None,
+                insurance_member_id=self.collected_data.member_id or None,
+                insurance_group=self.collected_data.group_number or None,
+                appointment_id=appointment_id
+            )
+            if result.startswith("SUCCESS"):
+                # Communications (SMS + Email), Excel export and reminder scheduling
+                # don't depend on each other, so run them concurrently
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    communication_future = executor.submit(self._send_immediate_communications, patient, appointment)
+                    export_future = executor.submit(self._handle_export_request)
+                    reminder_future = executor.submit(self._handle_reminder_request)
+                
+                # Each handler catches its own errors and returns a message
+                communication_result = communication_future.result()
+                export_result = export_future.result()
+                reminder_result = reminder_future.result()
+                
+                return self._BOOKING_CONFIRMATION_TEMPLATE.format(
+                    communication=communication_result,
+                    export=export_result,
+                    reminder=reminder_result
                 )
-                if result.startswith("SUCCESS"):
-                    # Send immediate communications (SMS + Email)
-                    communication_result = self._send_immediate_communications(patient, appointment)
-                    
-                    # Automatically export to Excel after successful booking
-                    export_result = self._handle_export_request()
-                    
-                    # Automatically schedule reminders after successful booking
-                    reminder_result = self._handle_reminder_request()
-                    
-                    return f"""✅ Your appointment has been booked successfully! 
-
-📱 **IMMEDIATE COMMUNICATIONS SENT:**
-{communication_result}
-
-📊 **AUTOMATIC ACTIONS COMPLETED:**
-{export_result}
-
-🔔 **REMINDER SYSTEM ACTIVATED:**
-{reminder_result}"""
-                else:
-                    return f"❌ There was an issue booking your appointment: {result}"
             else:
-                return "❌ Booking tool not available. Please try again later."
+                return f"❌ There was an issue booking your appointment: {result}"
         except Exception as e:
             return f"❌ Error booking appointment: {str(e)}"
     
     def _send_immediate_communications(self, patient, appointment) -> str:
         """Send immediate SMS and email after appointment confirmation"""
         try:
-            from communication import EmailService, SMSService
-            
-            print(f"🔍 DEBUG: Sending communications to {patient.email} and {patient.phone}")
+            logger.debug("Sending communications to %s and %s", patient.email, patient.phone)
             
-            # Send immediate communications
-            email_service = EmailService()
-            sms_service = SMSService()
+            email_service = self._email_service
+            sms_service = self._sms_service
             
-            # Send confirmation email
-            print("📧 Sending confirmation email...")
-            email_success = email_service.send_appointment_confirmation(patient, appointment)
-            print(f"📧 Email result: {email_success}")
-            
-            # Send confirmation SMS
-            print("📱 Sending confirmation SMS...")
             sms_message = f"Appointment confirmed for {appointment.appointment_date} at {appointment.appointment_time}. Confirmation email sent."
-            sms_success = sms_service.send_sms(patient.phone, sms_message)
-            print(f"📱 SMS result: {sms_success}")
             
-            # Send intake forms
-            print("📋 Sending intake forms...")
-            forms_success = email_service.send_intake_forms(patient, appointment)
-            print(f"📋 Forms result: {forms_success}")
+            # Email, SMS and intake forms each block on their own SMTP/Twilio
+            # round-trip, so send them concurrently
+            logger.debug("📧📱📋 Sending confirmation email, SMS and intake forms...")
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                email_future = executor.submit(email_service.send_appointment_confirmation, patient, appointment)
+                sms_future = executor.submit(sms_service.send_sms, patient.phone, sms_message)
+                forms_future = executor.submit(email_service.send_intake_forms, patient, appointment)
+            
+            email_success = email_future.result()
+            logger.debug("📧 Email result: %s", email_success)
+            sms_success = sms_future.result()
+            logger.debug("📱 SMS result: %s", sms_success)
+            forms_success = forms_future.result()
+            logger.debug("📋 Forms result: %s", forms_success)
             
             results = []
             if email_success:
@@ -581,326 +827,230 @@ class SimpleMedicalSchedulingAgent:
     
     def _extract_information(self, user_message: str):
         """Extract information from user message and update state"""
+        if self._parse_comma_format(user_message):
+            return  # Skip individual extraction if we found comma-separated format
+        
+        # Free-form text: run only the extractors whose trigger appears in the message
         message_lower = user_message.lower()
+        triggers = {match.lastgroup for match in self._FIELD_TRIGGERS.finditer(message_lower)}
+        for trigger, extractor in self._field_extractors:
+            if trigger is None or trigger in triggers:
+                extractor(user_message, message_lower)
+    
+    def _parse_comma_format(self, user_message: str) -> bool:
+        """
+        Store fields from "Name, DOB, Phone, Email, Doctor, Location", or from
+        "Name, DOB, Phone Email, Doctor, Location" with phone and email sharing a field.
+        Returns False, storing nothing, when the message is in neither shape.
+        """
+        comma_count = user_message.count(",")
+        if comma_count < 4:
+            return False
         
-        # Check if this is a comma-separated format (like "Name, DOB, Phone, Email, Doctor, Location")
-        if "," in user_message and user_message.count(",") >= 4:
-            parts = [part.strip() for part in user_message.split(",")]
-            if len(parts) >= 6:
-                # Extract from comma-separated format
-                self.collected_data["first_name"] = parts[0].split()[0] if parts[0] else ""
-                self.collected_data["last_name"] = parts[0].split()[-1] if len(parts[0].split()) > 1 else ""
-                self.collected_data["date_of_birth"] = parts[1] if parts[1] else ""
-                
-                # Extract phone from parts[2]
-                phone_part = parts[2] if parts[2] else ""
-                phone_match = re.search(r'(\+?\d{1,3}[-.\s]?\d{3,4}[-.\s]?\d{3,4}[-.\s]?\d{3,4})', phone_part)
-                if phone_match:
-                    self.collected_data["phone"] = re.sub(r'[^\d]', '', phone_match.group(1))
-                
-                # Extract email from parts[3]
-                email_part = parts[3] if parts[3] else ""
-                if "@" in email_part:
-                    self.collected_data["email"] = email_part
-                
-                self.collected_data["doctor_preference"] = parts[4] if parts[4] else ""
-                self.collected_data["location"] = parts[5] if parts[5] else ""
-                return  # Skip individual extraction if we found comma-separated format
-        
-        # Handle special case where phone and email are in same field without comma
-        # Pattern: "Name, DOB, Phone Email, Doctor, Location"
-        if "," in user_message and user_message.count(",") >= 4:
-            parts = [part.strip() for part in user_message.split(",")]
-            if len(parts) >= 5:
-                # Check if parts[2] contains both phone and email
-                phone_email_part = parts[2] if parts[2] else ""
-                if "@" in phone_email_part and re.search(r'\d', phone_email_part):
-                    # Extract from this special format
-                    self.collected_data["first_name"] = parts[0].split()[0] if parts[0] else ""
-                    self.collected_data["last_name"] = parts[0].split()[-1] if len(parts[0].split()) > 1 else ""
-                    self.collected_data["date_of_birth"] = parts[1] if parts[1] else ""
-                    
-                    # Extract phone and email from the combined field
-                    phone_match = re.search(r'(\+?\d{1,3}[-.\s]?\d{3,4}[-.\s]?\d{3,4}[-.\s]?\d{3,4})', phone_email_part)
-                    if phone_match:
-                        self.collected_data["phone"] = re.sub(r'[^\d]', '', phone_match.group(1))
-                    
-                    email_match = re.search(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', phone_email_part)
-                    if email_match:
-                        self.collected_data["email"] = email_match.group(1)
-                    
-                    self.collected_data["doctor_preference"] = parts[3] if parts[3] else ""
-                    self.collected_data["location"] = parts[4] if parts[4] else ""
-                    return  # Skip individual extraction if we found this special format
-        
-        # Handle case where phone and email are in same field with comma but no space
-        # Pattern: "Name, DOB, Phone,Email, Doctor, Location"
-        if "," in user_message and user_message.count(",") >= 4:
-            parts = [part.strip() for part in user_message.split(",")]
-            if len(parts) >= 6:
-                # Check if parts[2] and parts[3] are phone and email but parts[2] might contain email too
-                phone_part = parts[2] if parts[2] else ""
-                email_part = parts[3] if parts[3] else ""
-                
-                # If phone_part contains email, extract both from it
-                if "@" in phone_part and re.search(r'\d', phone_part):
-                    phone_match = re.search(r'(\+?\d{1,3}[-.\s]?\d{3,4}[-.\s]?\d{3,4}[-.\s]?\d{3,4})', phone_part)
-                    if phone_match:
-                        self.collected_data["phone"] = re.sub(r'[^\d]', '', phone_match.group(1))
-                    
-                    email_match = re.search(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', phone_part)
-                    if email_match:
-                        self.collected_data["email"] = email_match.group(1)
-                else:
-                    # Normal case - phone in parts[2], email in parts[3]
-                    phone_match = re.search(r'(\+?\d{1,3}[-.\s]?\d{3,4}[-.\s]?\d{3,4}[-.\s]?\d{3,4})', phone_part)
-                    if phone_match:
-                        self.collected_data["phone"] = re.sub(r'[^\d]', '', phone_match.group(1))
-                    
-                    # Extract email from email_part
-                    if "@" in email_part:
-                        self.collected_data["email"] = email_part
-                    elif "@" in phone_part:
-                        # Email might be in phone_part even if no digits
-                        email_match = re.search(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', phone_part)
-                        if email_match:
-                            self.collected_data["email"] = email_match.group(1)
-                
-                # Extract other fields
-                self.collected_data["first_name"] = parts[0].split()[0] if parts[0] else ""
-                self.collected_data["last_name"] = parts[0].split()[-1] if len(parts[0].split()) > 1 else ""
-                self.collected_data["date_of_birth"] = parts[1] if parts[1] else ""
-                self.collected_data["doctor_preference"] = parts[4] if parts[4] else ""
-                self.collected_data["location"] = parts[5] if parts[5] else ""
-                
-                # Ensure email is extracted
-                if not self.collected_data.get("email") and "@" in email_part:
-                    self.collected_data["email"] = email_part
-                
-                return  # Skip individual extraction if we found this format
-        
-        # Extract name
-        if "my name is" in message_lower or "i'm" in message_lower:
-            name_match = re.search(r"(?:my name is|i'm|i am)\s+([a-zA-Z\s]+)", user_message, re.IGNORECASE)
-            if name_match:
-                full_name = name_match.group(1).strip()
-                name_parts = full_name.split()
-                if len(name_parts) >= 2:
-                    self.collected_data["first_name"] = name_parts[0]
-                    self.collected_data["last_name"] = name_parts[-1]
-        
-        # Extract date of birth
-        dob_patterns = [
-            r"(\d{4}-\d{2}-\d{2})",
-            r"(\d{1,2}/\d{1,2}/\d{4})",
-            r"(\d{1,2}-\d{1,2}-\d{4})"
-        ]
-        for pattern in dob_patterns:
-            dob_match = re.search(pattern, user_message)
-            if dob_match:
-                self.collected_data["date_of_birth"] = dob_match.group(1)
-                break
+        parts = [part.strip() for part in user_message.split(",")]
+        phone_part = parts[2]
+        separate_email = comma_count >= 5  # Six or more parts
+        if not separate_email and not ("@" in phone_part and DIGIT_PATTERN.search(phone_part)):
+            return False
+        
+        first_name, _, rest = parts[0].partition(" ")
+        email_part = parts[3] if separate_email else ""
+        fields = {
+            "first_name": first_name,
+            "last_name": rest.rpartition(" ")[2],
+            "date_of_birth": parts[1],
+            "doctor_preference": parts[4] if separate_email else parts[3],
+            "location": parts[5] if separate_email else parts[4]
+        }
+        
+        phone_digits = phone_part.translate(PHONE_SEPARATORS)
+        if len(phone_digits) >= 10 and phone_digits.isascii() and phone_digits.isdigit():
+            # Plain number like "+1 (555) 123-4567": no need for the regex
+            fields["phone"] = phone_digits
+        else:
+            phone_match = PHONE_FIELD_PATTERN.search(phone_part)
+            if phone_match:
+                fields["phone"] = phone_match.group(1).translate(PHONE_SEPARATORS)
+        
+        # Email in its own field, or else typed into the phone field
+        email_match = EMAIL_PATTERN.search(email_part) or EMAIL_PATTERN.search(phone_part)
+        if email_match:
+            fields["email"] = email_match.group(1)
+        
+        self.set_collected_data(fields)
+        return True
+    
+    def _extract_name(self, user_message: str, message_lower: str):
+        """First and last name from "my name is ..." / "I'm ..." """
+        name_match = NAME_PATTERN.search(user_message)
+        if name_match:
+            full_name = name_match.group(1).strip()
+            first_name, separator, rest = full_name.partition(" ")
+            if separator:
+                self._set_field("first_name", first_name)
+                self._set_field("last_name", rest.rpartition(" ")[2])
+    
+    def _extract_date_of_birth(self, user_message: str, message_lower: str):
+        """Full date of birth, or an approximate one from "born in 1990" """
+        dob_match = DOB_PATTERN.search(user_message)
+        if dob_match:
+            self._set_field("date_of_birth", dob_match.group(1))
         
-        # Extract year of birth (for "born in 1990" patterns)
         if "born in" in message_lower:
-            year_match = re.search(r"born in (\d{4})", message_lower)
+            year_match = BORN_IN_PATTERN.search(message_lower)
             if year_match:
                 year = year_match.group(1)
                 # Convert to approximate date of birth
-                self.collected_data["date_of_birth"] = f"{year}-01-01"
-        
-        # Extract phone number
-        phone_match = re.search(r"(\d{3}[-.]?\d{3}[-.]?\d{4})", user_message)
+                self._set_field("date_of_birth", f"{year}-01-01")
+    
+    def _extract_phone(self, user_message: str, message_lower: str):
+        """Ten-digit phone number"""
+        phone_match = PHONE_PATTERN.search(user_message)
         if phone_match:
-            phone = re.sub(r'[^\d]', '', phone_match.group(1))
+            phone = phone_match.group(1).translate(PHONE_SEPARATORS)
             if len(phone) == 10:
-                self.collected_data["phone"] = phone
-        
-        # Extract email
-        email_match = re.search(r"([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})", user_message)
-        if email_match and not self.collected_data.get("email"):
-            self.collected_data["email"] = email_match.group(1)
-        
-        # Extract doctor preference
-        if "doctor" in message_lower or "dr." in message_lower or "physician" in message_lower:
-            doctor_match = re.search(r"(?:doctor|dr\.?|physician)\s+([a-zA-Z\s]+)", user_message, re.IGNORECASE)
-            if doctor_match:
-                self.collected_data["doctor_preference"] = doctor_match.group(1).strip()
-        
-        # Extract location
-        location_keywords = ["in", "from", "location", "city", "address"]
-        for keyword in location_keywords:
+                self._set_field("phone", phone)
+    
+    def _extract_email(self, user_message: str, message_lower: str):
+        """Email address, unless one was already collected"""
+        if not self.collected_data.email:
+            email_match = EMAIL_PATTERN.search(user_message)
+            if email_match:
+                self._set_field("email", email_match.group(1))
+    
+    def _extract_doctor(self, user_message: str, message_lower: str):
+        """Doctor preference following "doctor" / "Dr." / "physician" """
+        doctor_match = DOCTOR_PATTERN.search(user_message)
+        if doctor_match:
+            self._set_field("doctor_preference", doctor_match.group(1).strip())
+    
+    def _extract_location(self, user_message: str, message_lower: str):
+        """Location following "in", "from", "city", etc."""
+        location_match = LOCATION_PATTERN.search(user_message)
+        if location_match:
+            self._set_field("location", location_match.group(1).strip())
+    
+    def _extract_insurance_carrier(self, user_message: str, message_lower: str):
+        """First known insurance carrier mentioned"""
+        for keyword, carrier in self._CARRIER_NAMES.items():
             if keyword in message_lower:
-                # Simple location extraction - look for common city names or "in [location]"
-                location_match = re.search(rf"{keyword}\s+([a-zA-Z\s]+)", user_message, re.IGNORECASE)
-                if location_match:
-                    self.collected_data["location"] = location_match.group(1).strip()
-                    break
-        
-        # Extract insurance information - improved pattern matching
-        if "carrier" in message_lower or "insurance" in message_lower or "aetna" in message_lower or "blue cross" in message_lower or "cigna" in message_lower or "humana" in message_lower:
-            if "blue cross" in message_lower or "bcbs" in message_lower:
-                self.collected_data["insurance_carrier"] = "Blue Cross Blue Shield"
-            elif "aetna" in message_lower:
-                self.collected_data["insurance_carrier"] = "Aetna"
-            elif "cigna" in message_lower:
-                self.collected_data["insurance_carrier"] = "Cigna"
-            elif "humana" in message_lower:
-                self.collected_data["insurance_carrier"] = "Humana"
-        
-        # Extract member ID - improved patterns to handle various formats
-        member_id_patterns = [
-            r"member\s*id[:\s]*([a-zA-Z0-9]+)",
-            r"member\s*id[:\s]*([a-zA-Z0-9]+)",
-            r"member\s*id[:\s]*([a-zA-Z0-9]+)",
-            r"id[:\s]*([a-zA-Z0-9]+)",  # Just "ID: ABC123456789"
-            r"([a-zA-Z0-9]{8,})"  # Any alphanumeric string 8+ chars
-        ]
-        for pattern in member_id_patterns:
-            member_id_match = re.search(pattern, message_lower)
-            if member_id_match:
-                self.collected_data["member_id"] = member_id_match.group(1)
-                break
-        
-        # Extract group number - improved patterns
-        group_patterns = [
-            r"group\s*number[:\s]*(\d+)",
-            r"group[:\s]*(\d+)",
-            r"group\s*(\d+)",
-            r"number[:\s]*(\d{6,})"  # Just "Number: 654321"
-        ]
-        for pattern in group_patterns:
-            group_match = re.search(pattern, message_lower)
-            if group_match:
-                self.collected_data["group_number"] = group_match.group(1)
+                self._set_field("insurance_carrier", carrier)
                 break
     
+    def _extract_member_id(self, user_message: str, message_lower: str):
+        """Insurance member ID"""
+        # A bare token only counts once we know the carrier and still lack
+        # the ID, otherwise it would swallow unrelated words.
+        member_id_match = MEMBER_ID_PATTERN.search(user_message)
+        if (not member_id_match and self.collected_data.insurance_carrier
+                and not self.collected_data.member_id):
+            member_id_match = BARE_MEMBER_ID_PATTERN.search(user_message)
+        if member_id_match:
+            self._set_field("member_id", member_id_match.group(1))
+    
+    def _extract_group_number(self, user_message: str, message_lower: str):
+        """Insurance group number"""
+        group_match = GROUP_PATTERN.search(user_message)
+        if group_match:
+            self._set_field("group_number", group_match.group(1))
+    
     def get_conversation_history(self) -> List[Dict[str, Any]]:
         """Get conversation history in a format suitable for display"""
-        history = []
-        for msg in self.conversation_history:
-            if isinstance(msg, HumanMessage):
-                history.append({"content": msg.content, "is_user": True})
-            elif isinstance(msg, AIMessage):
-                history.append({"content": msg.content, "is_user": False})
-        return history
+        is_user = self._IS_USER_MESSAGE
+        return [
+            {"content": msg.content, "is_user": is_user[type(msg)]}
+            for msg in self.conversation_history
+            if type(msg) in is_user
+        ]
     
     def reset_conversation(self):
         """Reset the conversation state"""
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._set_summary(None)
+        self._summary_future = None
+        self._summary_backoff = 0
         self.current_step = "greeting"
-        self.collected_data = {}
+        self.collected_data = PatientData()
+        self._step_cache = None
     
     def get_conversation_state(self):
         """Get current conversation state for debugging"""
         return {
             "conversation_length": len(self.conversation_history),
             "current_step": self.current_step,
-            "collected_data": self.collected_data,
+            "collected_data": self.collected_data.to_dict(),
             "has_complete_info": self._has_complete_booking_info()
         }
     
     def get_collected_data(self) -> Dict[str, Any]:
         """Get the collected patient data"""
-        return self.collected_data.copy()
+        return self.collected_data.to_dict()
     
     def set_collected_data(self, data: Dict[str, Any]):
         """Set collected patient data"""
-        self.collected_data.update(data)
+        for key, value in data.items():
+            setattr(self.collected_data, key, value)
+        self._step_cache = None
     
     def _show_available_slots(self) -> str:
         """Show available appointment slots"""
-        from datetime import datetime, timedelta
         
-        # Generate available slots for the next 7 days
+        # The listing only depends on today's date, so reuse it until the day changes
         today = datetime.now().date()
-        slots = []
+        cached = SimpleMedicalSchedulingAgent._slots_cache
+        if cached is not None and cached[0] == today:
+            return cached[1]
+        
+        # Generate available slots for the next 7 days, grouped by day in date order
+        days: List[Tuple[str, List[Dict[str, str]]]] = []
         
         for i in range(7):
             current_date = today + timedelta(days=i)
             if current_date.weekday() < 5:  # Monday to Friday
-                # Morning slots
-                for hour in [9, 10, 11]:
-                    slot_time = datetime(current_date.year, current_date.month, current_date.day, hour, 0)
-                    slots.append({
-                        "date": current_date.strftime("%A, %B %d"),
-                        "time": slot_time.strftime("%I:%M %p"),
-                        "slot_id": f"slot_{i}_{hour}"
-                    })
-                # Afternoon slots
-                for hour in [14, 15, 16]:
-                    slot_time = datetime(current_date.year, current_date.month, current_date.day, hour, 0)
-                    slots.append({
-                        "date": current_date.strftime("%A, %B %d"),
-                        "time": slot_time.strftime("%I:%M %p"),
+                day_slots = []
+                for hour, time_label in SLOT_HOURS.items():
+                    day_slots.append({
+                        "time": time_label,
                         "slot_id": f"slot_{i}_{hour}"
                     })
+                days.append((current_date.strftime("%A, %B %d"), day_slots))
         
-        if not slots:
+        if not days:
             return "No available slots found. Please contact us directly to schedule your appointment."
         
-        # Format the response
-        response = "📅 **Available Appointment Slots:**\n\n"
-        
-        # Group slots by date
-        slots_by_date = {}
-        for slot in slots:
-            date = slot["date"]
-            if date not in slots_by_date:
-                slots_by_date[date] = []
-            slots_by_date[date].append(slot)
+        # Format the response, one line per entry, joined once at the end
+        lines = ["📅 **Available Appointment Slots:**", ""]
         
         # Display slots by date
-        for date in sorted(slots_by_date.keys()):
-            response += f"**{date}:**\n"
-            for slot in slots_by_date[date]:
-                response += f"  • {slot['time']} (Slot ID: {slot['slot_id']})\n"
-            response += "\n"
+        for date_str, day_slots in days:
+            lines.append(f"**{date_str}:**")
+            for slot in day_slots:
+                lines.append(f"  • {slot['time']} (Slot ID: {slot['slot_id']})")
+            lines.append("")
         
-        response += "Please select a time slot by telling me the time (e.g., '9:00 AM' or '2:00 PM') or the slot ID."
+        lines.append("Please select a time slot by telling me the time (e.g., '9:00 AM' or '2:00 PM') or the slot ID.")
+        response = "\n".join(lines)
         
+        SimpleMedicalSchedulingAgent._slots_cache = (today, response)
         return response
     
     def _extract_slot_selection(self, message: str) -> str:
         """Extract slot selection from user message"""
-        import re
-        from datetime import datetime
         
         # Look for time patterns like "9:00 AM", "2:30 PM", etc.
-        time_patterns = [
-            r'(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)',
-            r'(\d{1,2}):(\d{2})',
-            r'(\d{1,2})\s*(AM|PM|am|pm)',
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, message, re.IGNORECASE)
-            if match:
-                return match.group(0)
+        match = SLOT_TIME_PATTERN.search(message)
+        if match:
+            return match.group(0)
         
         # Look for slot ID patterns
-        slot_id_pattern = r'slot_\d+_\d+'
-        slot_match = re.search(slot_id_pattern, message.lower())
+        slot_match = SLOT_ID_PATTERN.search(message.lower())
         if slot_match:
             return slot_match.group(0)
         
         # Look for common time expressions
-        time_expressions = {
-            'morning': '9:00 AM',
-            'afternoon': '2:00 PM', 
-            'evening': '4:00 PM',
-            'first slot': '9:00 AM',
-            'second slot': '10:00 AM',
-            'third slot': '11:00 AM',
-            'lunch time': '12:00 PM',
-            'after lunch': '2:00 PM',
-            'last slot': '4:00 PM'
-        }
-        
-        message_lower = message.lower()
-        for expr, time in time_expressions.items():
-            if expr in message_lower:
-                return time
+        expression_match = SLOT_TIME_EXPRESSION_PATTERN.search(message)
+        if expression_match:
+            return SLOT_TIME_EXPRESSIONS[expression_match.group(0).lower()]
         
         return None
     
@@ -0,0 +1,49 @@
+"""
+Prompt window tests: the messages sent to the LLM must alternate user/assistant
+after the system messages, starting with the user
+"""
+from collections import deque
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from simple_agent_fixed import HISTORY_WINDOW, SimpleMedicalSchedulingAgent, recent_window
+
+
+def _history(turns: int) -> deque:
+    """`turns` completed user/assistant turns followed by a new user message"""
+    history = deque()
+    for i in range(turns):
+        history.append(HumanMessage(content=f"user {i}"))
+        history.append(AIMessage(content=f"assistant {i}"))
+    history.append(HumanMessage(content="latest"))
+    return history
+
+
+def _assert_alternates(messages):
+    turns = [m for m in messages if not isinstance(m, SystemMessage)]
+    assert isinstance(turns[0], HumanMessage)
+    for previous, current in zip(turns, turns[1:]):
+        assert type(previous) is not type(current)
+
+
+def test_recent_window_starts_with_user_message():
+    for turns in range(3 * HISTORY_WINDOW):
+        window = recent_window(_history(turns), HISTORY_WINDOW)
+        assert len(window) <= HISTORY_WINDOW
+        assert window[-1].content == "latest"
+        _assert_alternates(window)
+
+
+def test_context_messages_alternate_while_summary_is_outstanding():
+    # Only the state _context_messages reads; a summary that never arrived
+    # leaves the history longer than the window
+    agent = SimpleMedicalSchedulingAgent.__new__(SimpleMedicalSchedulingAgent)
+    agent.static_prefix = [SystemMessage(content="system")]
+    agent._summary_message = None
+    agent._summary_future = None
+    agent.conversation_history = _history(HISTORY_WINDOW)
+
+    messages = agent._context_messages()
+
+    assert isinstance(messages[0], SystemMessage)
+    _assert_alternates(messages)
@@ -5,14 +5,39 @@ from langchain.tools import BaseTool
 from typing import Optional, Type, List, Dict, Any
 from pydantic import BaseModel, Field
 from datetime import datetime, date, timedelta
+from functools import cache
+from itertools import islice
 import re
 import uuid
+import orjson
 
 from database import DatabaseManager
-from emr_database import EMRDatabase
-from models import Patient, PatientType, Doctor, Appointment, AppointmentStatus, Insurance, Reminder, ReminderType
+from emr_database import EMRDatabase, TTLCache
+from models import Patient, PatientType, Doctor, Appointment, AppointmentStatus, Insurance, Reminder, ReminderType, NON_DIGIT_PATTERN
 from config import Config
 
+# Tools share one manager of each kind per process, so the patient index and the
+# per-thread SQLite connections outlive a single tool call. A racing first call may
+# build a spare instance, which is harmless: setup is idempotent and state on disk.
+@cache
+def _db() -> DatabaseManager:
+    return DatabaseManager()
+
+@cache
+def _emr() -> EMRDatabase:
+    return EMRDatabase()
+
+# patient_lookup results keyed on normalized inputs plus the patient CSV's mtime,
+# so any write to the CSV (through any manager) makes older entries unreachable
+_patient_lookup_cache = TTLCache(maxsize=1024, ttl=300.0)
+
+# (sequence number, (reminder type, hours before the appointment)) for each reminder
+# scheduled per appointment, resolved once at import
+_REMINDER_PLAN = tuple(enumerate(zip(
+    (ReminderType.INITIAL, ReminderType.FORM_CHECK, ReminderType.CONFIRMATION),
+    Config.REMINDER_HOURS
+), 1))
+
 class PatientLookupInput(BaseModel):
     """Input for patient lookup tool"""
     first_name: str = Field(description="Patient's first name")
@@ -33,9 +58,6 @@ class PatientLookupTool(BaseTool):
     description = "Look up an existing patient by name and date of birth. Returns patient information if found, None if new patient."
     args_schema: Type[BaseModel] = PatientLookupInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
@@ -43,9 +65,17 @@ class PatientLookupTool(BaseTool):
         try:
             # Parse date
             dob = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
+            first_name, last_name = first_name.strip(), last_name.strip()
+            phone = NON_DIGIT_PATTERN.sub('', phone) if phone else None
             
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
+            
+            # Repeated lookups within a conversation are answered from the cache
+            cache_key = (first_name.lower(), last_name.lower(), dob, phone or None, db.patients_mtime())
+            hit, result = _patient_lookup_cache.get(cache_key)
+            if hit:
+                return result
             
             # Try to find patient by name and DOB first
             patient = db.find_patient_by_name_dob(first_name, last_name, dob)
@@ -55,9 +85,12 @@ class PatientLookupTool(BaseTool):
                 patient = db.find_patient_by_phone(phone)
             
             if patient:
-                return f"EXISTING_PATIENT: {patient.id}|{patient.first_name}|{patient.last_name}|{patient.patient_type.value}|{patient.phone}|{patient.email}"
+                result = f"EXISTING_PATIENT: {patient.id}|{patient.first_name}|{patient.last_name}|{patient.patient_type.value}|{patient.phone}|{patient.email}"
             else:
-                return "NEW_PATIENT"
+                result = "NEW_PATIENT"
+            
+            _patient_lookup_cache.put(cache_key, result)
+            return result
                 
         except Exception as e:
             return f"ERROR: {str(e)}"
@@ -79,9 +112,6 @@ class AddPatientTool(BaseTool):
     description = "Add a new patient to the database. Use this when patient lookup returns NEW_PATIENT."
     args_schema: Type[BaseModel] = AddPatientInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
@@ -89,11 +119,10 @@ class AddPatientTool(BaseTool):
              email: str, address: str, emergency_contact: str, emergency_phone: str) -> str:
         try:
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
             # Generate patient ID
-            patients = db.load_patients()
-            patient_id = f"P{str(len(patients) + 1).zfill(4)}"
+            patient_id = db.next_patient_id()
             
             # Parse date
             dob = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
@@ -134,35 +163,22 @@ class GetDoctorsTool(BaseTool):
     description = "Get list of available doctors, optionally filtered by specialty or location"
     args_schema: Type[BaseModel] = GetDoctorsInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
     def _run(self, specialty: Optional[str] = None, location: Optional[str] = None) -> str:
         try:
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
-            doctors = db.load_doctors()
-            
-            # Apply filters
-            if specialty:
-                doctors = [d for d in doctors if specialty.lower() in d.specialty.lower()]
-            
-            if location:
-                doctors = [d for d in doctors if location.lower() in d.location.lower()]
+            # Filter through the database's specialty/location indexes
+            doctors = db.find_doctors(specialty=specialty, location=location)
             
             if not doctors:
                 return "NO_DOCTORS_FOUND"
             
             # Format response
-            doctor_list = []
-            for doctor in doctors:
-                doctor_list.append(f"{doctor.id}|{doctor.name}|{doctor.specialty}|{doctor.location}")
-            
-            return "|".join(doctor_list)
+            return "|".join([f"{d.id}|{d.name}|{d.specialty}|{d.location}" for d in doctors])
             
         except Exception as e:
             return f"ERROR: {str(e)}"
@@ -179,9 +195,6 @@ class GetAvailableSlotsTool(BaseTool):
     description = "Get available time slots for a specific doctor on a specific date"
     args_schema: Type[BaseModel] = GetAvailableSlotsInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
@@ -191,7 +204,7 @@ class GetAvailableSlotsTool(BaseTool):
             apt_date = datetime.strptime(appointment_date, '%Y-%m-%d').date()
             
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
             # Get available slots
             slots = db.get_available_slots(doctor_id, apt_date, duration)
@@ -214,6 +227,7 @@ class BookAppointmentInput(BaseModel):
     insurance_carrier: Optional[str] = Field(default=None, description="Insurance carrier")
     insurance_member_id: Optional[str] = Field(default=None, description="Insurance member ID")
     insurance_group: Optional[str] = Field(default=None, description="Insurance group number")
+    appointment_id: Optional[str] = Field(default=None, description="Pre-allocated appointment ID (optional, allocated if omitted)")
 
 class BookAppointmentTool(BaseTool):
     """Tool to book an appointment"""
@@ -221,22 +235,19 @@ class BookAppointmentTool(BaseTool):
     description = "Book an appointment for a patient with a doctor"
     args_schema: Type[BaseModel] = BookAppointmentInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
     def _run(self, patient_id: str, doctor_id: str, appointment_date: str, 
              appointment_time: str, duration: int, insurance_carrier: Optional[str] = None,
-             insurance_member_id: Optional[str] = None, insurance_group: Optional[str] = None) -> str:
+             insurance_member_id: Optional[str] = None, insurance_group: Optional[str] = None,
+             appointment_id: Optional[str] = None) -> str:
         try:
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
-            # Generate appointment ID
-            appointments = db.load_appointments()
-            appointment_id = f"APT{str(len(appointments) + 1).zfill(4)}"
+            # Use the caller's ID when it already told the patient one, else allocate
+            appointment_id = appointment_id or db.next_appointment_id()
             
             # Parse date
             apt_date = datetime.strptime(appointment_date, '%Y-%m-%d').date()
@@ -288,39 +299,35 @@ class ScheduleRemindersTool(BaseTool):
     description = "Schedule reminder notifications for an appointment"
     args_schema: Type[BaseModel] = ScheduleRemindersInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
     def _run(self, appointment_id: str, patient_id: str, appointment_date: str, appointment_time: str) -> str:
         try:
-            # Parse appointment datetime
+            # Parse appointment datetime; strptime also accepts unpadded parts like "2025-1-5 9:00"
             apt_datetime = datetime.strptime(f"{appointment_date} {appointment_time}", '%Y-%m-%d %H:%M')
             
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
             # Schedule reminders
-            reminder_types = [ReminderType.INITIAL, ReminderType.FORM_CHECK, ReminderType.CONFIRMATION]
-            reminder_hours = Config.REMINDER_HOURS
-            
-            for i, (reminder_type, hours_before) in enumerate(zip(reminder_types, reminder_hours)):
-                reminder_id = f"REM{appointment_id.replace('APT', '')}{i+1}"
-                scheduled_time = apt_datetime - timedelta(hours=hours_before)
-                
-                reminder = Reminder(
-                    id=reminder_id,
+            reminder_number = appointment_id.removeprefix('APT')
+            reminders = [
+                Reminder(
+                    id=f"REM{reminder_number}{i}",
                     appointment_id=appointment_id,
                     patient_id=patient_id,
                     reminder_type=reminder_type,
-                    scheduled_time=scheduled_time
+                    scheduled_time=apt_datetime - timedelta(hours=hours_before)
                 )
-                
-                db.save_reminder(reminder)
+                for i, (reminder_type, hours_before) in _REMINDER_PLAN
+            ]
+            
+            # One write for all reminders instead of one per reminder
+            if not db.save_reminders(reminders):
+                return f"ERROR: Failed to save reminders for appointment {appointment_id}"
             
-            return f"SUCCESS: 3 reminders scheduled for appointment {appointment_id}"
+            return f"SUCCESS: {len(reminders)} reminders scheduled for appointment {appointment_id}"
             
         except Exception as e:
             return f"ERROR: {str(e)}"
@@ -331,23 +338,28 @@ class ExportAppointmentsTool(BaseTool):
     description = "Export all appointments to Excel file for admin review"
     args_schema: Type[BaseModel] = BaseModel  # No input needed
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
     def _run(self) -> str:
         try:
             # Get database manager
-            db = DatabaseManager()
+            db = _db()
             
             # Get appointments data
             df = db.get_appointments_for_export()
             
-            # Save to Excel
+            # Save to Excel, streaming rows through a write-only workbook instead of
+            # letting to_excel build the whole openpyxl cell model in memory first
             export_file = f"data/appointments_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            df.to_excel(export_file, index=False)
+            from openpyxl import Workbook  # deferred: only exports need it
+            
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Sheet1")
+            sheet.append(list(df.columns))
+            for row in df.itertuples(index=False, name=None):
+                sheet.append(row)
+            workbook.save(export_file)
             
             return f"SUCCESS: Appointments exported to {export_file}"
             
@@ -357,12 +369,9 @@ class ExportAppointmentsTool(BaseTool):
 class SmartPatientLookupTool(BaseTool):
     """Smart tool for looking up patient information using EMR database"""
     name = "smart_patient_lookup"
-    description = "Look up patient information using EMR database with automatic new vs returning detection"
+    description = "Look up patient information using EMR database with automatic new vs returning detection. Returns JSON with found, patient_type, duration and, if found, the patient's record."
     args_schema: Type[BaseModel] = SmartPatientLookupInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
@@ -370,39 +379,35 @@ class SmartPatientLookupTool(BaseTool):
              first_name: Optional[str] = None, last_name: Optional[str] = None) -> str:
         """Look up patient information using EMR database"""
         try:
-            emr_db = EMRDatabase()
+            emr_db = _emr()
             
             # Use EMR database to detect patient type and get full record
             patient_record, patient_type = emr_db.detect_patient_type(
                 phone=phone, email=email, first_name=first_name, last_name=last_name
             )
             
-            if patient_record:
-                # Patient found in EMR
-                medical_info = f"Medical History: {', '.join(patient_record.medical_history[:3])}..." if patient_record.medical_history else "No medical history"
-                allergies_info = f"Allergies: {', '.join(patient_record.allergies)}" if patient_record.allergies else "No known allergies"
-                medications_info = f"Current Medications: {', '.join(patient_record.current_medications)}" if patient_record.current_medications else "No current medications"
-                
-                return f"""✅ PATIENT FOUND IN EMR SYSTEM:
-                
-👤 Name: {patient_record.first_name} {patient_record.last_name}
-🆔 Patient ID: {patient_record.patient_id}
-📅 DOB: {patient_record.date_of_birth}
-📱 Phone: {patient_record.phone}
-📧 Email: {patient_record.email}
-🏥 Patient Type: {patient_type.upper()}
-📊 Total Visits: {patient_record.total_visits}
-📅 Last Visit: {patient_record.last_visit or 'Never'}
-⏱️ Appointment Duration: {emr_db.get_smart_duration(patient_record, patient_type)} minutes
-
-🏥 MEDICAL INFORMATION:
-{medical_info}
-{allergies_info}
-{medications_info}
-
-💊 Insurance: {patient_record.insurance_provider} (ID: {patient_record.insurance_id})"""
-            else:
-                return f"❌ Patient not found in EMR system. This appears to be a NEW PATIENT."
+            duration = emr_db.get_smart_duration(patient_record, patient_type)
+            if not patient_record:
+                return orjson.dumps({'found': False, 'patient_type': patient_type, 'duration': duration}).decode()
+            
+            return orjson.dumps({
+                'found': True,
+                'patient_type': patient_type,
+                'duration': duration,
+                'patient_id': patient_record.patient_id,
+                'first_name': patient_record.first_name,
+                'last_name': patient_record.last_name,
+                'date_of_birth': patient_record.date_of_birth,
+                'phone': patient_record.phone,
+                'email': patient_record.email,
+                'total_visits': patient_record.total_visits,
+                'last_visit': patient_record.last_visit,
+                'medical_history': patient_record.medical_history,
+                'allergies': patient_record.allergies,
+                'current_medications': patient_record.current_medications,
+                'insurance_provider': patient_record.insurance_provider,
+                'insurance_id': patient_record.insurance_id
+            }).decode()
             
         except Exception as e:
             return f"Error looking up patient in EMR: {str(e)}"
@@ -410,77 +415,54 @@ class SmartPatientLookupTool(BaseTool):
 class SmartSchedulingTool(BaseTool):
     """Smart scheduling tool that automatically determines appointment duration based on EMR data"""
     name = "smart_scheduling"
-    description = "Schedule appointment with automatic duration detection (60min for new, 30min for returning patients)"
+    description = "Schedule appointment with automatic duration detection (60min for new, 30min for returning patients). Returns JSON with patient_type, duration, date and up to 5 open slots."
     args_schema: Type[BaseModel] = PatientLookupInput
     
-    def __init__(self):
-        super().__init__()
-    
     class Config:
         arbitrary_types_allowed = True
     
     def _run(self, first_name: str, last_name: str, date_of_birth: str, phone: Optional[str] = None) -> str:
         """Smart scheduling with automatic duration detection"""
         try:
-            emr_db = EMRDatabase()
+            emr_db = _emr()
             
-            # Detect patient type using EMR database
-            patient_record, patient_type = emr_db.detect_patient_type(
+            # Only the patient type is needed here, so skip loading the full EMR record
+            is_returning = emr_db.is_returning_patient(
                 phone=phone, first_name=first_name, last_name=last_name
             )
+            patient_type = 'returning' if is_returning else 'new'
             
             # Get smart duration based on patient type
-            duration = emr_db.get_smart_duration(patient_record, patient_type)
+            duration = Config.RETURNING_PATIENT_DURATION if is_returning else Config.NEW_PATIENT_DURATION
             
             # Get available slots for tomorrow
             tomorrow = date.today() + timedelta(days=1)
-            db = DatabaseManager()
+            db = _db()
             
-            # Get available slots for different doctors
+            # Get available slots for different doctors in one pass over the data,
+            # stopping at the first doctor that completes the slots we show
             doctors = ["D001", "D002", "D003", "D004", "D005"]
-            suitable_slots = []
-            
-            for doctor_id in doctors:
-                try:
-                    slots = db.get_available_slots(doctor_id, tomorrow.strftime('%Y-%m-%d'), duration)
-                    for slot in slots:
-                        suitable_slots.append({
-                            'date': tomorrow.strftime('%Y-%m-%d'),
-                            'time': slot,
-                            'doctor_id': doctor_id,
-                            'doctor_name': f"Dr. {doctor_id}"
-                        })
-                except:
-                    # If specific doctor doesn't have slots, continue
-                    continue
-            
-            if not suitable_slots:
-                return f"No available slots for {duration}-minute appointment on {tomorrow.strftime('%Y-%m-%d')}"
-            
-            # Format available slots
-            slots_info = []
-            for slot in suitable_slots[:5]:  # Show first 5 slots
-                slots_info.append(f"📅 {slot['date']} at {slot['time']} ({slot['doctor_name']})")
-            
-            return f"""🎯 SMART SCHEDULING RESULT:
-            
-👤 Patient: {first_name} {last_name}
-🏥 Patient Type: {patient_type.upper()}
-⏱️ Recommended Duration: {duration} minutes
-📱 Phone: {phone or 'Not provided'}
-
-📅 AVAILABLE SLOTS:
-{chr(10).join(slots_info)}
-
-💡 The system automatically detected this as a {patient_type} patient and assigned {duration} minutes for the appointment."""
+            suitable_slots = list(islice((
+                {'time': slot, 'doctor_id': doctor_id, 'doctor_name': f"Dr. {doctor_id}"}
+                for doctor_id, slots in db.iter_available_slots(doctors, tomorrow, duration)
+                for slot in slots
+            ), 5))  # Show first 5 slots
+            
+            return orjson.dumps({
+                'patient_type': patient_type,
+                'duration': duration,
+                'date': tomorrow,
+                'slots': suitable_slots
+            }).decode()
             
         except Exception as e:
             return f"Error in smart scheduling: {str(e)}"
 
 
+@cache
 def get_all_tools():
-    """Get all available tools"""
-    return [
+    """Get all available tools, shared process-wide since they hold no state"""
+    return (
         PatientLookupTool(),
         SmartPatientLookupTool(),
         SmartSchedulingTool(),
@@ -490,4 +472,4 @@ def get_all_tools():
         BookAppointmentTool(),
         ScheduleRemindersTool(),
         ExportAppointmentsTool(),
-    ]
+    )